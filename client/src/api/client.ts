@@ -25,6 +25,54 @@ export const runWorkflow = async (
   return response.data;
 };
 
+export interface WorkflowStreamHandlers {
+  onNodeStart?: (data: any) => void;
+  onNodeEnd?: (data: any) => void;
+  onToken?: (nodeId: string, text: string) => void;
+}
+
+// Runs a workflow via the server-sent-events endpoint; resolves with the
+// final WorkflowResponse once the "done" event arrives
+export const streamWorkflow = async (
+  workflow: any,
+  userQuery: string,
+  handlers: WorkflowStreamHandlers,
+  signal?: AbortSignal
+) => {
+  const response = await fetch(`${API_URL}/run_workflow/stream`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ workflow, user_query: userQuery }),
+    signal,
+  });
+  if (!response.ok || !response.body) {
+    throw new Error(`Workflow stream failed (${response.status})`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const raw = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      const event = raw.match(/^event: (.*)$/m)?.[1];
+      const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] || "{}");
+      if (event === "node_start") handlers.onNodeStart?.(data);
+      else if (event === "node_end") handlers.onNodeEnd?.(data);
+      else if (event === "token") handlers.onToken?.(data.node_id, data.text);
+      else if (event === "done") return data;
+      else if (event === "error") throw new Error(data.detail);
+    }
+  }
+  throw new Error("Workflow stream ended unexpectedly.");
+};
+
 export const uploadDocument = async (file: File) => {
   const formData = new FormData();
   formData.append("file", file);
@@ -37,6 +85,26 @@ export const uploadDocument = async (file: File) => {
   return response.data;
 };
 
+export const getIngestJob = async (jobId: string) => {
+  const response = await apiClient.get(`/ingest/${jobId}`);
+  return response.data;
+};
+
+// Polls an ingest job until it finishes; resolves with the final job status
+export const waitForIngestJob = async (
+  jobId: string,
+  onProgress?: (job: any) => void,
+  intervalMs = 1000
+) => {
+  for (;;) {
+    const job = await getIngestJob(jobId);
+    onProgress?.(job);
+    if (job.status === "done") return job;
+    if (job.status === "failed") throw new Error(job.error || "Indexing failed.");
+    await new Promise((resolve) => setTimeout(resolve, intervalMs));
+  }
+};
+
 // Stack API
 export const getStacks = async () => {
   const response = await apiClient.get("/stacks/");
@@ -1,6 +1,5 @@
 import { useState, useEffect, useRef } from "react";
-import { runWorkflow } from "@/api/client";
-import axios from "axios";
+import { streamWorkflow } from "@/api/client";
 import { useFlowStore } from "@/store/useFlowStore";
 import { convertFlowToWorkflow } from "@/lib/workflowConverter";
 import { cn } from "@/lib/utils";
@@ -80,26 +79,38 @@ export function ChatPanel() {
       );
       console.log("ChatPanel: User Message:", userMsg.content);
 
-      const result = await runWorkflow(
+      // Tokens of the first LLM node to answer are shown as they arrive;
+      // the final answer replaces them when the run completes
+      let streamingNode: string | null = null;
+      let streamed = "";
+      const showAssistant = (content: string, replaceLast: boolean) =>
+        setMessages((prev) => [
+          ...(replaceLast ? prev.slice(0, -1) : prev),
+          { role: "assistant", content },
+        ]);
+
+      const result = await streamWorkflow(
         workflow,
         userMsg.content,
+        {
+          onToken: (nodeId, token) => {
+            if (streamingNode === null) streamingNode = nodeId;
+            if (nodeId !== streamingNode) return;
+            streamed += token;
+            showAssistant(streamed, streamed !== token);
+          },
+        },
         controller.signal
       );
 
-      const assistantMsg: Message = {
-        role: "assistant",
-        content: result.answer,
-      };
-      setMessages((prev) => [...prev, assistantMsg]);
+      showAssistant(result.answer, streamingNode !== null);
     } catch (error: unknown) {
-      if (axios.isCancel(error)) {
+      if ((error as Error).name === "AbortError") {
         return; // Already handled in handleStop
       }
       console.error(error);
       const errorMsg =
-        // eslint-disable-next-line @typescript-eslint/no-explicit-any
-        (error as any).response?.data?.detail ||
-        "Error executing workflow. Check backend.";
+        (error as Error).message || "Error executing workflow. Check backend.";
       setMessages((prev) => [
         ...prev,
         { role: "system", content: `Error: ${errorMsg}` },
@@ -1,6 +1,6 @@
 import { Handle, Position, type NodeProps, type Node } from "@xyflow/react";
 import { useRef, useState } from "react";
-import { uploadDocument } from "@/api/client";
+import { uploadDocument, waitForIngestJob } from "@/api/client";
 import { toast } from "sonner";
 import { Loader2, Upload, Database } from "lucide-react";
 import { useFlowStore } from "@/store/useFlowStore";
@@ -33,7 +33,15 @@ export function KnowledgeBaseNode({
     const toastId = toast.loading("Uploading document...");
 
     try {
-      await uploadDocument(file);
+      const { job_id } = await uploadDocument(file);
+      // eslint-disable-next-line @typescript-eslint/no-explicit-any
+      await waitForIngestJob(job_id, (job: any) => {
+        const label =
+          job.stage === "embedding" && job.chunks_total
+            ? `Indexing document... ${job.chunks_done}/${job.chunks_total} chunks`
+            : "Indexing document...";
+        toast.loading(label, { id: toastId });
+      });
       toast.success("Document uploaded", { id: toastId });
 
       updateNodeData(id, {
@@ -45,7 +53,7 @@ export function KnowledgeBaseNode({
     } catch (error: unknown) {
       console.error(error);
       // eslint-disable-next-line @typescript-eslint/no-explicit-any
-      const msg = (error as any).response?.data?.detail || "Upload failed.";
+      const msg = (error as any).response?.data?.detail || (error as Error).message || "Upload failed.";
       toast.error("Upload failed", { id: toastId, description: msg });
     } finally {
       setIsUploading(false);
@@ -1,46 +1,217 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+import asyncio
+import json
+import os
+import zipfile
+from typing import List
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import ValidationError
 from models.workflow import WorkflowExecuteRequest, WorkflowResponse
-from services.workflow_engine import execute_workflow
-from services.document_processor import extract_text_from_pdf, chunk_text
-from services.vector_store import add_documents
-import uuid
+from services.workflow_engine import execute_workflow, workflow_flight
+from services.document_processor import CHUNKERS
+from services.uploads import (
+    spool_upload, remove_spool_file, extract_zip_pdfs, UploadBudget, UploadTooLarge, TooManyFiles,
+    BULK_MAX_FILES, MAX_BULK_UPLOAD_BYTES,
+)
+from services.bulk_ingest import ingest_bulk
+from services.ingest_jobs import enqueue_ingest_job, get_ingest_job, job_status, INGEST_SPOOL_DIR
+from services.embedding_cache import get_embedding_cache
+from services.retrieval_cache import get_retrieval_cache
+from services.llm_cache import get_llm_cache
+from services.llm_providers import provider_stats
+from services.vector_store import retrieval_flight
+from services.embeddings import rate_limiter as embedding_rate_limiter, query_coalescer, query_embedding_flight
+from services.workflow_plan import plan_cache
 
 router = APIRouter()
 
+# Chunker used when an upload doesn't pick one ("fixed" or "structured")
+CHUNKER_DEFAULT = os.getenv("CHUNKER_DEFAULT", "fixed")
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "100"))
+
 @router.post("/run_workflow", response_model=WorkflowResponse)
 async def run_workflow(request: WorkflowExecuteRequest):
     try:
-        response = await execute_workflow(request.workflow, request.user_query)
+        response = await execute_workflow(request.workflow, request.user_query, include_spans=request.include_spans)
         return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/upload")
-async def upload_document(file: UploadFile = File(...)):
+@router.post("/run_workflow/stream")
+async def run_workflow_stream(request: WorkflowExecuteRequest):
+    """Server-sent events: node_start / node_end per node, token for each LLM
+    token as it arrives, then done (the WorkflowResponse) or error."""
+    events = asyncio.Queue()
+
+    async def on_event(event: str, data: dict):
+        await events.put((event, data))
+
+    async def run():
+        try:
+            response = await execute_workflow(
+                request.workflow, request.user_query, on_event=on_event, include_spans=request.include_spans
+            )
+            await events.put(("done", response.model_dump()))
+        except Exception as e:
+            await events.put(("error", {"detail": str(e)}))
+        finally:
+            await events.put(None)
+
+    async def stream():
+        task = asyncio.ensure_future(run())
+        try:
+            while True:
+                item = await events.get()
+                if item is None:
+                    break
+                event, data = item
+                yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+        finally:
+            # Client went away: stop the run
+            task.cancel()
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.post("/upload", status_code=202)
+async def upload_document(
+    file: UploadFile = File(...),
+    chunker: str = Form(CHUNKER_DEFAULT),
+    chunk_size: int = Form(CHUNK_SIZE),
+    chunk_overlap: int = Form(CHUNK_OVERLAP),
+):
     
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="Only PDFs are supported")
+
+    if chunker not in CHUNKERS:
+        raise HTTPException(status_code=400, detail=f"Unknown chunker '{chunker}'. Use one of: {', '.join(CHUNKERS)}")
+    if chunk_size <= 0 or not 0 <= chunk_overlap < chunk_size:
+        raise HTTPException(status_code=400, detail="chunk_size must be positive and chunk_overlap between 0 and chunk_size")
     
-    content = await file.read()
+    # Stream the upload to a spool file (size limit enforced while reading).
+    # The file stays on disk until the background job has indexed it.
+    try:
+        spool_path = await spool_upload(file, directory=INGEST_SPOOL_DIR)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    job = await enqueue_ingest_job(
+        file.filename,
+        spool_path,
+        {"chunker": chunker, "chunk_size": chunk_size, "chunk_overlap": chunk_overlap},
+    )
+    return {
+        "message": "File queued for indexing",
+        "job_id": job["id"],
+        "status": job["status"],
+    }
+
+def _is_zip(file: UploadFile) -> bool:
+    return file.content_type in ("application/zip", "application/x-zip-compressed") or (file.filename or "").lower().endswith(".zip")
 
+@router.post("/upload/bulk")
+async def upload_bulk(
+    files: List[UploadFile] = File(...),
+    chunker: str = Form(CHUNKER_DEFAULT),
+    chunk_size: int = Form(CHUNK_SIZE),
+    chunk_overlap: int = Form(CHUNK_OVERLAP),
+):
+    """Indexes many PDFs and/or ZIP archives of PDFs in one request.
+
+    Streams newline-delimited JSON: one result per file as it finishes, then
+    a {"summary": ...} line.
+    """
+    if chunker not in CHUNKERS:
+        raise HTTPException(status_code=400, detail=f"Unknown chunker '{chunker}'. Use one of: {', '.join(CHUNKERS)}")
+    if chunk_size <= 0 or not 0 <= chunk_overlap < chunk_size:
+        raise HTTPException(status_code=400, detail="chunk_size must be positive and chunk_overlap between 0 and chunk_size")
+
+    spooled = []   # [(source, spool path)]
+    skipped = []   # results for files that are never parsed
+    # Content-Length is only checked up front; this counts the bytes actually spooled, ZIP members decompressed
+    budget = UploadBudget()
     try:
-        text = extract_text_from_pdf(content)
-    except Exception as e:
-         raise HTTPException(status_code=500, detail=f"PDF Processing Error: {e}")
+        for file in files:
+            if _is_zip(file):
+                zip_path = await spool_upload(file, max_bytes=MAX_BULK_UPLOAD_BYTES, suffix=".zip")
+                try:
+                    members = await asyncio.to_thread(
+                        extract_zip_pdfs, zip_path, BULK_MAX_FILES - len(spooled), budget=budget
+                    )
+                except zipfile.BadZipFile:
+                    skipped.append({"source": file.filename, "status": "failed", "error": "Not a valid ZIP archive"})
+                    continue
+                finally:
+                    remove_spool_file(zip_path)
+                spooled.extend(members)
+            elif file.content_type == "application/pdf":
+                if len(spooled) >= BULK_MAX_FILES:
+                    raise TooManyFiles()
+                spooled.append((file.filename, await spool_upload(file, budget=budget)))
+            else:
+                skipped.append({"source": file.filename, "status": "failed", "error": "Only PDFs and ZIP archives of PDFs are supported"})
+    except (UploadTooLarge, TooManyFiles) as e:
+        for _, path in spooled:
+            remove_spool_file(path)
+        raise HTTPException(status_code=413, detail=str(e))
 
-    if not text:
-        raise HTTPException(status_code=400, detail="Failed to extract text. The PDF might be a scanned image or empty. Please upload a text-based PDF.")
-        
-    chunks = chunk_text(text)
-    
-    # Store in Chroma
-    ids = [str(uuid.uuid4()) for _ in chunks]
-    metadatas = [{"source": file.filename} for _ in chunks]
-    
+    # Two files with the same name would overwrite each other's chunks
+    unique, seen = [], set()
+    for source, path in spooled:
+        if source in seen:
+            remove_spool_file(path)
+            skipped.append({"source": source, "status": "failed", "error": "Duplicate file name in this upload"})
+            continue
+        seen.add(source)
+        unique.append((source, path))
+
+    if not unique and not skipped:
+        raise HTTPException(status_code=400, detail="No PDFs found in the upload")
+
+    async def stream():
+        for result in skipped:
+            yield json.dumps(result) + "\n"
+        if not unique:
+            return
+        async for result in ingest_bulk(unique, chunk_size, chunk_overlap, chunker):
+            if "summary" in result:
+                result["summary"]["files"] += len(skipped)
+                result["summary"]["failed"] += len(skipped)
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@router.get("/ingest/{job_id}")
+async def ingest_job_status(job_id: str):
     try:
-        await add_documents(documents=chunks, metadatas=metadatas, ids=ids)
+        job = await get_ingest_job(job_id)
     except Exception as e:
-         raise HTTPException(status_code=500, detail=f"Error storing embeddings: {e}")
+        raise HTTPException(status_code=500, detail=f"Error loading job: {e}")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Ingest job not found")
+    return job_status(job)
 
-    return {"message": "File processed and indexed successfully", "chunks": len(chunks)}
+@router.get("/cache/stats")
+async def cache_stats():
+    embedding_cache = get_embedding_cache()
+    retrieval_cache = get_retrieval_cache()
+    llm_cache = get_llm_cache()
+    return {
+        "embeddings": embedding_cache.stats() if embedding_cache else None,
+        "retrieval": retrieval_cache.stats() if retrieval_cache else None,
+        "embedding_rate_limiter": embedding_rate_limiter.stats(),
+        "query_coalescer": query_coalescer.stats() if query_coalescer else None,
+        "workflow_plans": plan_cache.stats(),
+        "llm": llm_cache.stats() if llm_cache else None,
+        "llm_providers": provider_stats(),
+        "single_flight": {
+            "workflows": workflow_flight.stats(),
+            "retrieval": retrieval_flight.stats(),
+            "query_embeddings": query_embedding_flight.stats(),
+        },
+    }
@@ -0,0 +1,56 @@
+import math
+import os
+import sys
+
+from services.document_processor import iter_pdf_pages, CHUNKERS
+from services.parse_pool import parse_pdf_page_chunks
+
+# Compares the chunkers on real PDFs without calling the embedding API.
+# Measures the per-page chunking that ingestion uses (each page chunked on
+# its own, see iter_page_chunks), run in-process.
+# Usage: python benchmark_chunking.py [file.pdf ...] (defaults to ../test_data.pdf)
+
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "100"))
+
+
+def benchmark(path: str, chunker: str) -> dict:
+    pages = parse_pdf_page_chunks(path, CHUNK_SIZE, CHUNK_OVERLAP, chunker)
+    chunks = [text for page in pages for text in page["chunks"]]
+    source_chars = sum(len(text) for _, text in iter_pdf_pages(path))
+    embedded_chars = sum(len(chunk) for chunk in chunks)
+    megabytes = os.path.getsize(path) / (1024 * 1024)
+    return {
+        "chunks": len(chunks),
+        "chunks_per_mb": len(chunks) / megabytes if megabytes else 0.0,
+        "embedded_chars": embedded_chars,
+        "redundancy": embedded_chars / source_chars if source_chars else 0.0,
+        "embed_calls": math.ceil(len(chunks) / EMBED_BATCH_SIZE),
+        "mid_word_cuts": sum(1 for chunk in chunks if chunk[-1:].isalnum() and not chunk.rstrip().endswith((".", "!", "?"))),
+    }
+
+
+def main(paths: list):
+    print(f"chunk_size={CHUNK_SIZE} overlap={CHUNK_OVERLAP} embed_batch_size={EMBED_BATCH_SIZE}")
+    header = f"{'file':<30} {'chunker':<11} {'chunks':>7} {'chunks/MB':>10} {'chars':>9} {'x source':>9} {'calls':>6} {'cut ends':>9}"
+    print(header)
+    print("-" * len(header))
+    totals = {name: {"chunks": 0, "embedded_chars": 0, "embed_calls": 0} for name in CHUNKERS}
+    for path in paths:
+        for name in CHUNKERS:
+            result = benchmark(path, name)
+            for key in totals[name]:
+                totals[name][key] += result[key]
+            print(
+                f"{os.path.basename(path)[:30]:<30} {name:<11} {result['chunks']:>7} {result['chunks_per_mb']:>10.1f} "
+                f"{result['embedded_chars']:>9} {result['redundancy']:>9.2f} {result['embed_calls']:>6} {result['mid_word_cuts']:>9}"
+            )
+    print()
+    for name, total in totals.items():
+        print(f"{name:<11} total chunks={total['chunks']} embedded chars={total['embedded_chars']} "
+              f"embedding calls/doc={total['embed_calls'] / len(paths):.2f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test_data.pdf")])
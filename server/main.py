@@ -21,13 +21,37 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+from fastapi.responses import JSONResponse, PlainTextResponse
+from services.uploads import content_length_too_large, MAX_UPLOAD_BYTES, MAX_BULK_UPLOAD_BYTES
+
+@app.middleware("http")
+async def reject_oversized_uploads(request, call_next):
+    # Reject declared-oversized uploads before the multipart body is read
+    if request.method == "POST" and request.url.path.startswith("/api/upload"):
+        max_bytes = MAX_BULK_UPLOAD_BYTES if request.url.path.startswith("/api/upload/bulk") else MAX_UPLOAD_BYTES
+        if content_length_too_large(request.headers.get("content-length"), max_bytes):
+            return JSONResponse(
+                status_code=413,
+                content={"detail": f"Upload exceeds the maximum size of {max_bytes // (1024 * 1024)} MB"},
+            )
+    return await call_next(request)
+
 from api.routes import router as api_router
 from api.stacks import router as stacks_router
 from database import init_db, async_session
 from services.seed import seed_db
+from services.http_clients import init_clients, close_clients
+from services.embedding_cache import close_embedding_cache
+from services.vector_backend import close_vector_store
+from services.vector_store import rebuild_lexical_index
+from services.parse_pool import start_parse_pool, shutdown_parse_pool
+from services.ingest_jobs import resume_ingest_jobs, stop_ingest_workers
+from services.metrics import render_prometheus
 
 @app.on_event("startup")
 async def on_startup():
+    await init_clients()
+    start_parse_pool()
     try:
         await init_db()
         async with async_session() as session:
@@ -38,6 +62,27 @@ async def on_startup():
         import traceback
         traceback.print_exc()
 
+    try:
+        indexed = await rebuild_lexical_index()
+        print(f"Lexical index loaded with {indexed} chunks.")
+    except Exception as e:
+        print(f"Lexical index warm-up failed (will fill as documents are ingested): {e}")
+
+    try:
+        resumed = await resume_ingest_jobs()
+        if resumed:
+            print(f"Resumed {resumed} ingest jobs.")
+    except Exception as e:
+        print(f"Failed to resume ingest jobs: {e}")
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await stop_ingest_workers()
+    shutdown_parse_pool()
+    await close_clients()
+    await close_embedding_cache()
+    await close_vector_store()
+
 app.include_router(api_router, prefix="/api")
 app.include_router(stacks_router, prefix="/api/stacks", tags=["Stacks"])
 
@@ -50,5 +95,10 @@ async def root():
 async def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics")
+async def metrics():
+    # Prometheus text format: span duration histograms and counters
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
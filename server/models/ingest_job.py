@@ -0,0 +1,22 @@
+from sqlalchemy import Column, String, DateTime, JSON, Integer, Text
+import uuid
+from datetime import datetime
+from database import Base
+
+class IngestJob(Base):
+    __tablename__ = "ingest_jobs"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    source = Column(String, nullable=False)
+    spool_path = Column(String, nullable=True)
+    options = Column(JSON, default=dict)
+    status = Column(String, nullable=False, default="queued")  # queued | running | done | failed
+    stage = Column(String, nullable=False, default="queued")   # queued | parsing | embedding | done | failed
+    chunks_total = Column(Integer, default=0)
+    chunks_done = Column(Integer, default=0)    # stored, including chunks unchanged since the last ingest
+    chunks_failed = Column(Integer, default=0)  # chunks whose embedding or store failed
+    attempts = Column(Integer, default=0)
+    result = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -25,10 +25,13 @@ class WorkflowDefinition(BaseModel):
 class WorkflowExecuteRequest(BaseModel):
     workflow: WorkflowDefinition
     user_query: str
+    # Return per-node and per-upstream-call timing spans with the response
+    include_spans: bool = False
 
 class WorkflowResponse(BaseModel):
     answer: str
     logs: List[str] = []
+    spans: Optional[List[Dict[str, Any]]] = None
 
 class StackBase(BaseModel):
     name: str
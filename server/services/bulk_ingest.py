@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import os
+import time
+
+from services.ingestion import plan_pdf, finish_source, source_lock
+from services.vector_store import add_documents, INGEST_PAGE_SIZE
+from services.embeddings import EMBED_MAX_CONCURRENCY
+from services.parse_pool import PARSE_MAX_CONCURRENT
+from services.uploads import remove_spool_file
+
+# Bulk ingestion of many PDFs in one request.
+# Files are parsed concurrently, and the chunks that need embedding are packed
+# into shared, full-size batches across files instead of one partly filled
+# batch per file. Results are yielded per file as soon as every chunk of that
+# file has been stored. Memory is bounded: at most BULK_FILES_IN_FLIGHT files
+# are parsed or waiting to be stored (their plans hold the chunk texts), and
+# at most BULK_BATCHES_IN_FLIGHT batches are being embedded and stored.
+
+BULK_FILES_IN_FLIGHT = int(os.getenv("BULK_FILES_IN_FLIGHT", str(PARSE_MAX_CONCURRENT * 2)))
+BULK_BATCHES_IN_FLIGHT = int(os.getenv("BULK_BATCHES_IN_FLIGHT", str(EMBED_MAX_CONCURRENCY)))
+
+
+class _FileState:
+    def __init__(self, plan: dict):
+        self.plan = plan
+        self.pending = len(plan["new"]["ids"])
+        self.stored = 0
+        self.failed_pages = []
+        self.failed_ids = []
+
+
+class BatchPacker:
+    """Collects chunks from many files and embeds them in full batches."""
+
+    def __init__(self, on_file_done, batch_size: int = INGEST_PAGE_SIZE, max_in_flight: int = BULK_BATCHES_IN_FLIGHT):
+        self.on_file_done = on_file_done
+        self.batch_size = batch_size
+        self._rows = []       # [(file state, row index)] waiting for a batch
+        self._tasks = set()
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self.batches = 0
+
+    async def add(self, plan: dict):
+        state = _FileState(plan)
+        if not state.pending:
+            await self._finish(state)
+            return
+        self._rows.extend((state, row) for row in range(state.pending))
+        while len(self._rows) >= self.batch_size:
+            rows = self._rows[:self.batch_size]
+            del self._rows[:self.batch_size]
+            await self._flush(rows)
+
+    async def flush_partial(self):
+        """Sends the rows waiting for a full batch now (e.g. when no more files can start)."""
+        if self._rows:
+            rows, self._rows = self._rows, []
+            await self._flush(rows)
+
+    async def close(self):
+        """Embeds the final partial batch and waits for every batch in flight."""
+        await self.flush_partial()
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks))
+
+    def cancel(self):
+        for task in self._tasks:
+            task.cancel()
+
+    async def _flush(self, rows: list):
+        # Waits while BULK_BATCHES_IN_FLIGHT batches are being stored
+        await self._in_flight.acquire()
+        self.batches += 1
+        task = asyncio.ensure_future(self._store(list(rows), self.batches))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        task.add_done_callback(lambda _: self._in_flight.release())
+
+    async def _store(self, rows: list, batch_no: int):
+        try:
+            report = await add_documents(
+                documents=[state.plan["new"]["documents"][row] for state, row in rows],
+                metadatas=[state.plan["new"]["metadatas"][row] for state, row in rows],
+                ids=[state.plan["new"]["ids"][row] for state, row in rows],
+            )
+            error = "; ".join(f["error"] for f in report["failed_pages"]) or None
+            failed_ids = set(report["failed_ids"])
+        except Exception as e:
+            logging.error(f"Bulk Batch Error (batch {batch_no}): {e}", exc_info=True)
+            error, failed_ids = str(e), None
+
+        by_state = {}
+        for state, row in rows:
+            by_state.setdefault(state, []).append(state.plan["new"]["ids"][row])
+        for state, ids in by_state.items():
+            failed = [id_ for id_ in ids if failed_ids is None or id_ in failed_ids]
+            state.stored += len(ids) - len(failed)
+            if failed:
+                state.failed_ids.extend(failed)
+                state.failed_pages.append({"page": batch_no, "stage": "embed", "error": error, "chunks": len(failed)})
+            state.pending -= len(ids)
+            if state.pending == 0:
+                await self._finish(state)
+
+    async def _finish(self, state: _FileState):
+        try:
+            report = await finish_source(state.plan, state.stored, state.failed_pages, state.failed_ids)
+        except Exception as e:
+            await self.on_file_done({"source": state.plan["source"], "status": "failed", "error": f"Error storing embeddings: {e}"})
+            return
+        if report["new"] and report["stored"] == 0:
+            report["status"] = "failed"
+            report["error"] = "Error storing embeddings: " + "; ".join(f["error"] for f in report["failed_pages"][:3])
+        else:
+            report["status"] = "partial" if report["failed_pages"] else "done"
+        await self.on_file_done(report)
+
+
+async def _next_result(results: asyncio.Queue, runner: asyncio.Future) -> dict:
+    """Waits for the next file result, surfacing a crash of the pipeline instead of hanging."""
+    while True:
+        if not results.empty():
+            return results.get_nowait()
+        if runner.done():
+            runner.result()
+            raise RuntimeError("Bulk ingestion finished without a result for every file")
+        getter = asyncio.ensure_future(results.get())
+        await asyncio.wait({getter, runner}, return_when=asyncio.FIRST_COMPLETED)
+        if getter.done():
+            return getter.result()
+        getter.cancel()
+
+
+async def ingest_bulk(files: list, chunk_size: int = 1000, overlap: int = 100, chunker: str = "fixed"):
+    """Ingests [(source, spool path)] and yields one result dict per file, then a summary.
+
+    Spool files are removed once parsed (or when the generator is closed early).
+    Each source's lock is held from planning until its result is produced.
+    """
+    started = time.monotonic()
+    results = asyncio.Queue()
+    held = {}  # source -> its source_lock, until the file's result is produced
+    file_slots = asyncio.Semaphore(BULK_FILES_IN_FLIGHT)
+
+    async def file_done(result: dict):
+        lock = held.pop(result["source"], None)
+        if lock is not None:
+            lock.release()
+        file_slots.release()
+        await results.put(result)
+
+    async def unblock():
+        # Files whose last chunks sit in a partial batch keep their slots; when
+        # every slot is taken, send that batch rather than wait for more files
+        if file_slots.locked():
+            await packer.flush_partial()
+
+    packer = BatchPacker(file_done)
+    remaining = {path for _, path in files}
+
+    async def parse_one(source: str, path: str):
+        try:
+            lock = source_lock(source)
+            await lock.acquire()
+            held[source] = lock
+            plan = await plan_pdf(source, path, chunk_size, overlap, chunker)
+        except Exception as e:
+            await file_done({"source": source, "status": "failed", "error": str(e)})
+            return
+        finally:
+            remove_spool_file(path)
+            remaining.discard(path)
+        await packer.add(plan)
+        await unblock()
+
+    async def run():
+        parsing = set()
+        try:
+            for source, path in files:
+                await unblock()
+                await file_slots.acquire()
+                task = asyncio.ensure_future(parse_one(source, path))
+                parsing.add(task)
+                task.add_done_callback(parsing.discard)
+            await asyncio.gather(*list(parsing))
+        finally:
+            for task in parsing:
+                task.cancel()
+        await packer.close()
+
+    runner = asyncio.ensure_future(run())
+    summary = {"files": len(files), "done": 0, "partial": 0, "failed": 0, "chunks": 0, "stored": 0}
+    try:
+        for _ in range(len(files)):
+            result = await _next_result(results, runner)
+            summary[result["status"]] += 1
+            summary["chunks"] += result.get("chunks", 0)
+            summary["stored"] += result.get("stored", 0)
+            yield result
+        await runner
+    finally:
+        runner.cancel()
+        packer.cancel()
+        for path in list(remaining):
+            remove_spool_file(path)
+        for lock in held.values():
+            lock.release()
+        held.clear()
+
+    summary["embedding_batches"] = packer.batches
+    summary["seconds"] = round(time.monotonic() - started, 3)
+    yield {"summary": summary}
@@ -0,0 +1,183 @@
+import logging
+import os
+
+from services.http_clients import get_chroma_client
+from services.metrics import span
+from services.vector_backend import VectorStore, empty_result
+from services.partitioned_store import PartitionedVectorStore, partition_slug
+
+CHROMA_HOST = os.getenv("CHROMA_HOST", "localhost")
+CHROMA_PORT = os.getenv("CHROMA_PORT", "8001")
+HOST_URL = f"http://{CHROMA_HOST}:{CHROMA_PORT}"
+# Standard V1 Root for ID-based ops
+API_V1_URL = f"{HOST_URL}/api/v1"
+API_V2_URL = f"{HOST_URL}/api/v2"
+# Tenant URL for Create/List
+TENANT = "default_tenant"
+DATABASE = "default_database"
+TENANT_API_URL = f"{API_V2_URL}/tenants/{TENANT}/databases/{DATABASE}"
+
+COLLECTION_NAME = "knowledge_base"
+# One collection per source document instead of one shared collection
+CHROMA_PARTITION_BY_SOURCE = os.getenv("CHROMA_PARTITION_BY_SOURCE", "false").lower() in ("1", "true", "yes")
+
+
+class ChromaVectorStore(VectorStore):
+    """Chroma server accessed over its REST API."""
+
+    name = "chroma"
+
+    def __init__(self, collection_name: str = COLLECTION_NAME, collection_metadata: dict = None):
+        self.collection_name = collection_name
+        self.collection_metadata = collection_metadata or {}
+        self._collection_id = None
+
+    async def get_collection_id(self):
+        if self._collection_id:
+            return self._collection_id
+
+        client = get_chroma_client()
+        try:
+            # Create collection (Use Tenant logic)
+            payload = {"name": self.collection_name, "metadata": {"hnsw:space": "cosine", **self.collection_metadata}}
+
+            # Try Creating at Tenant Level
+            resp = await client.post(f"{TENANT_API_URL}/collections", json=payload)
+
+            if resp.status_code == 200:
+                self._collection_id = resp.json()["id"]
+                return self._collection_id
+
+            # If exists or fails, List it at Tenant Level
+            logs = await client.get(f"{TENANT_API_URL}/collections")
+            if logs.status_code == 200:
+                for col in logs.json():
+                    if col["name"] == self.collection_name:
+                        self._collection_id = col["id"]
+                        return self._collection_id
+
+        except Exception as e:
+            print(f"Error getting collection: {e}")
+            return None
+
+        return None
+
+    async def _post(self, op: str, payload: dict):
+        col_id = await self.get_collection_id()
+        if not col_id:
+            raise Exception("Chroma Collection not found/created")
+
+        # Using Tenant-Scoped V2 URL as strictly required by this Chroma version
+        # Previously failed with V1 ID-based URLs
+        url = f"{TENANT_API_URL}/collections/{col_id}/{op}"
+        try:
+            with span("chroma", {"collection": self.collection_name}, op=op) as s:
+                resp = await get_chroma_client().post(url, json=payload)
+                s.set(status=resp.status_code)
+        except Exception as cx:
+            logging.error(f"Chroma Connection Error: {cx}", exc_info=True)
+            raise cx
+
+        if resp.status_code not in (200, 201):
+            print(f"Chroma {op} failed ({resp.status_code}): {resp.text}")
+            logging.error(f"Chroma {op} Error {resp.status_code}: {resp.text}")
+            raise Exception(f"Chroma {op} failed ({resp.status_code}): {resp.text}")
+        return resp.json() if resp.content else None
+
+    async def add(self, ids: list, embeddings: list, documents: list, metadatas: list):
+        payload = {"ids": ids, "embeddings": embeddings, "metadatas": metadatas, "documents": documents}
+        await self._post("add", payload)
+
+    async def upsert(self, ids: list, embeddings: list, documents: list, metadatas: list):
+        payload = {"ids": ids, "embeddings": embeddings, "metadatas": metadatas, "documents": documents}
+        await self._post("upsert", payload)
+
+    async def update_metadata(self, ids: list, metadatas: list):
+        if not ids:
+            return
+        await self._post("update", {"ids": ids, "metadatas": metadatas})
+
+    async def query(self, embedding: list, n_results: int = 3, where: dict = None) -> dict:
+        payload = {
+            "query_embeddings": [embedding],
+            "n_results": n_results,
+            "include": ["documents", "metadatas", "distances"],
+        }
+        if where:
+            payload["where"] = where
+
+        try:
+            data = await self._post("query", payload)
+        except Exception as e:
+            print(f"Query failed: {e}")
+            return empty_result()
+
+        # Chroma returns one result list per query embedding
+        result = empty_result()
+        for key in result:
+            rows = (data or {}).get(key) or []
+            result[key] = (rows[0] or []) if rows else []
+        return result
+
+    async def get(self, ids: list = None, where: dict = None, include_documents: bool = True) -> dict:
+        payload = {"include": ["documents", "metadatas"] if include_documents else ["metadatas"]}
+        if ids is not None:
+            payload["ids"] = ids
+        if where:
+            payload["where"] = where
+
+        data = await self._post("get", payload) or {}
+        return {
+            "ids": data.get("ids") or [],
+            "documents": data.get("documents") or [None] * len(data.get("ids") or []),
+            "metadatas": data.get("metadatas") or [],
+        }
+
+    async def delete(self, ids: list = None, where: dict = None):
+        if ids is None and not where:
+            return
+        payload = {}
+        if ids is not None:
+            if not ids:
+                return
+            payload["ids"] = ids
+        if where:
+            payload["where"] = where
+        await self._post("delete", payload)
+
+    async def count(self) -> int:
+        col_id = await self.get_collection_id()
+        if not col_id:
+            return 0
+        resp = await get_chroma_client().get(f"{TENANT_API_URL}/collections/{col_id}/count")
+        if resp.status_code != 200:
+            return 0
+        return int(resp.json())
+
+
+def open_partitioned_chroma_store() -> PartitionedVectorStore:
+    """One Chroma collection per source, named knowledge_base_<hash> and tagged with the source."""
+    prefix = f"{COLLECTION_NAME}_"
+
+    def make_partition(source: str) -> ChromaVectorStore:
+        return ChromaVectorStore(
+            collection_name=f"{prefix}{partition_slug(source)}",
+            collection_metadata={"source": source},
+        )
+
+    async def list_sources() -> list:
+        try:
+            resp = await get_chroma_client().get(f"{TENANT_API_URL}/collections")
+            if resp.status_code != 200:
+                return []
+            return [
+                col["metadata"]["source"]
+                for col in resp.json()
+                if col["name"].startswith(prefix) and (col.get("metadata") or {}).get("source")
+            ]
+        except Exception as e:
+            print(f"Error listing Chroma partitions: {e}")
+            logging.error(f"Chroma Partition List Error: {e}", exc_info=True)
+            return []
+
+    return PartitionedVectorStore(make_partition, list_sources, name="chroma")
@@ -0,0 +1,202 @@
+import hashlib
+import os
+
+from services.rate_limiter import estimate_tokens
+
+# Builds the context block of llmEngine prompts from retrieved chunks.
+# Chunks are taken best first until the model's token budget is used up.
+# Duplicates (the same chunk reached through several knowledgeBase nodes or
+# retrieval modes) are dropped, and chunks that follow each other in the same
+# source are merged into one passage with their shared overlap removed.
+
+# Default budget for the context block, in estimated tokens
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# Per-model overrides by model name prefix, e.g. "gpt-4o=8000,llama-3.1-8b=2000"
+CONTEXT_TOKEN_BUDGETS = os.getenv("CONTEXT_TOKEN_BUDGETS", "")
+# Shortest shared text treated as chunk overlap
+MIN_OVERLAP_CHARS = 20
+# Chunk overlap assumed for chunks stored without their "chunk_overlap" metadata
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "100"))
+
+
+def _parse_budgets(raw: str) -> dict:
+    budgets = {}
+    for item in raw.split(","):
+        prefix, _, value = item.partition("=")
+        if prefix.strip() and value.strip():
+            budgets[prefix.strip()] = int(value)
+    return budgets
+
+
+_model_budgets = _parse_budgets(CONTEXT_TOKEN_BUDGETS)
+
+
+def token_budget(model: str, override=None) -> int:
+    """Context budget for `model`: the node's override, else the longest matching prefix, else the default."""
+    if override:
+        return int(override)
+    matches = [prefix for prefix in _model_budgets if model.startswith(prefix)]
+    if matches:
+        return _model_budgets[max(matches, key=len)]
+    return CONTEXT_TOKEN_BUDGET
+
+
+def overlap_length(previous: str, following: str, max_overlap: int = CHUNK_OVERLAP) -> int:
+    """Length of the longest suffix of `previous`, at most `max_overlap` chars, that starts `following`.
+
+    Neighbouring chunks share at most the chunking overlap; without the cap,
+    repetitive text matches much longer suffixes and real content is trimmed.
+    Returns 0 below MIN_OVERLAP_CHARS.
+    """
+    probe = following[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS or max_overlap < MIN_OVERLAP_CHARS:
+        return 0
+    tail = previous[-max_overlap:]
+    start = tail.find(probe)
+    while start != -1:
+        if following.startswith(tail[start:]):
+            return len(tail) - start
+        start = tail.find(probe, start + 1)
+    return 0
+
+
+def _rank_hits(hit_lists: list) -> list:
+    """Best-first order across several result lists, without comparing scores from different retrievers."""
+    ranked = []
+    for list_no, hits in enumerate(hit_lists):
+        for rank, hit in enumerate(hits):
+            ranked.append((rank, list_no, hit))
+    ranked.sort(key=lambda item: (item[0], item[1]))
+    return [hit for _, _, hit in ranked]
+
+
+def _position(hit: dict):
+    meta = hit.get("metadata") or {}
+    if meta.get("source") is None or meta.get("chunk") is None:
+        return None
+    return meta["source"], int(meta["chunk"])
+
+
+def _max_overlap(hit: dict) -> int:
+    overlap = (hit.get("metadata") or {}).get("chunk_overlap")
+    return int(overlap) if overlap is not None else CHUNK_OVERLAP
+
+
+def _passage_header(number: int, chunks: list) -> str:
+    meta = chunks[0].get("metadata") or {}
+    header = f"[{number}]"
+    if meta.get("source"):
+        header += f" {meta['source']}"
+    pages = [
+        page
+        for chunk in chunks
+        for page in ((chunk.get("metadata") or {}).get("page_start"), (chunk.get("metadata") or {}).get("page_end"))
+        if page is not None
+    ]
+    if pages:
+        first, last = min(pages), max(pages)
+        header += f" (p. {first})" if first == last else f" (pp. {first}-{last})"
+    return header
+
+
+def _render(selected: dict, rank: dict) -> tuple:
+    """Merges runs of consecutive chunks per source and returns (context text, passage count)."""
+    passages = []
+    current = None
+    ordered = sorted(
+        selected.values(),
+        key=lambda hit: (_position(hit) is None, _position(hit) or ("", rank.get(id(hit), 0))),
+    )
+    for hit in ordered:
+        position = _position(hit)
+        if current is not None and position is not None and current["end"] == (position[0], position[1] - 1):
+            text = hit["document"]
+            overlap = overlap_length(current["text"], text, _max_overlap(hit))
+            current["text"] += text[overlap:] if overlap else "\n" + text
+            current["chunks"].append(hit)
+            current["end"] = position
+            current["best"] = min(current["best"], rank.get(id(hit), 0))
+            continue
+        current = {"text": hit["document"], "chunks": [hit], "end": position, "best": rank.get(id(hit), 0)}
+        passages.append(current)
+    # Passages keep relevance order
+    passages.sort(key=lambda passage: passage["best"])
+
+    blocks = [f"{_passage_header(i, p['chunks'])}\n{p['text'].strip()}" for i, p in enumerate(passages, start=1)]
+    return "\n\n".join(blocks), len(passages)
+
+
+def assemble_context(hit_lists: list, budget: int) -> tuple:
+    """Packs retrieved chunks into one context block of at most ~`budget` tokens.
+
+    `hit_lists` holds one best-first list of {"id", "document", "metadata"}
+    hits per knowledgeBase node. Returns (context text, report); the report
+    compares the result with the old list-repr context.
+    """
+    all_hits = [hit for hits in hit_lists for hit in hits]
+    report = {
+        "chunks": len(all_hits),
+        "duplicates": 0,
+        "used": 0,
+        "dropped": 0,
+        "passages": 0,
+        "budget": budget,
+        "tokens_before": estimate_tokens(str([hit["document"] for hit in all_hits])) if all_hits else 0,
+        "tokens_after": 0,
+        "chunk_ids": [],
+    }
+    if not all_hits:
+        return "", report
+
+    # 1. Best first, duplicates removed
+    candidates = []
+    seen = set()
+    for hit in _rank_hits(hit_lists):
+        document = hit.get("document") or ""
+        key = hashlib.sha256(document.encode("utf-8")).hexdigest()
+        if not document.strip() or key in seen or (hit.get("id") is not None and hit["id"] in seen):
+            report["duplicates"] += 1
+            continue
+        seen.add(key)
+        if hit.get("id") is not None:
+            seen.add(hit["id"])
+        candidates.append(hit)
+    rank = {id(hit): i for i, hit in enumerate(candidates)}
+
+    # 2. Greedy packing, measured on the rendered block: passage headers and
+    # separators count, and a chunk merged into its neighbour's passage only
+    # costs the text after their overlap.
+    selected = {}  # position (or id) -> hit
+    for hit in candidates:
+        key = _position(hit) or hit.get("id")
+        selected[key] = hit
+        attempt, _ = _render(selected, rank)
+        if estimate_tokens(attempt) > budget:
+            del selected[key]
+            report["dropped"] += 1
+
+    if not selected and candidates:
+        # Not even the best chunk fits: keep its beginning rather than nothing
+        header = _passage_header(1, [candidates[0]])
+        room = max(1, (budget - 1) * 4 - len(header) - 1)
+        best = dict(candidates[0], document=candidates[0]["document"][:room])
+        selected[_position(best) or best.get("id")] = best
+        report["dropped"] -= 1
+
+    # 3. Final block: runs of consecutive chunks merged per source, passages in relevance order
+    context, report["passages"] = _render(selected, rank)
+    report["used"] = len(selected)
+    report["tokens_after"] = estimate_tokens(context)
+    report["chunk_ids"] = sorted(str(hit.get("id")) for hit in selected.values())
+    return context, report
+
+
+def describe_reduction(label: str, report: dict) -> str:
+    """One log line summarising what assemble_context did."""
+    before, after = report["tokens_before"], report["tokens_after"]
+    saved = f" (-{round(100 * (before - after) / before)}%)" if before > after else ""
+    return (
+        f"Context for {label}: {report['used']}/{report['chunks']} chunks in {report['passages']} passages, "
+        f"{report['duplicates']} duplicates removed, {report['dropped']} over budget; "
+        f"~{before} -> ~{after} tokens{saved} (budget {report['budget']})"
+    )
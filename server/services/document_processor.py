@@ -1,36 +1,183 @@
 import fitz  # PyMuPDF
-import io
-
-def extract_text_from_pdf(file_content: bytes) -> str:
-    """Extracts text from a PDF file content."""
-    text = ""
-    try:
-        with fitz.open(stream=file_content, filetype="pdf") as doc:
-            for page in doc:
-                text += page.get_text()
-    except Exception as e:
-        print(f"Error extracting PDF: {e}")
-        return ""
-    
-    if not text.strip():
-        # Scanned PDF or Image-only
-        print("Warning: PDF extracted text is empty (possibly scanned)")
-        return ""
-
-    return text
+import hashlib
+import re
+from typing import Iterable, Iterator, Union
+
+def iter_pdf_pages(source: Union[bytes, str]) -> Iterator[tuple]:
+    """Yields (page_number, text) one page at a time. `source` is PDF bytes or a file path."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        doc = fitz.open(stream=source, filetype="pdf")
+    else:
+        doc = fitz.open(source, filetype="pdf")
+    with doc:
+        for page_number, page in enumerate(doc, start=1):
+            yield page_number, page.get_text()
 
 def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 100) -> list[str]:
     """Splits text into chunks with overlap."""
     if not text:
         return []
-    
+
     chunks = []
     start = 0
     text_len = len(text)
-    
+
     while start < text_len:
         end = min(start + chunk_size, text_len)
         chunks.append(text[start:end])
         start += (chunk_size - overlap)
-        
+
+    return chunks
+
+# --- Structure-aware chunking -------------------------------------------------
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])["\')\]]*\s+(?=["\'(\[]?[A-Z0-9])')
+_TERMINAL = (".", "!", "?", ":", ";", '"', "'", ")")
+HEADING_MAX_CHARS = 80
+
+def _is_heading(line: str) -> bool:
+    """Short standalone lines without sentence punctuation (titles, numbered sections)."""
+    line = line.strip()
+    if not line or len(line) > HEADING_MAX_CHARS or line.endswith((".", ",", ";", "!", "?")):
+        return False
+    return len(line.split()) <= 12 and (line.isupper() or line.istitle() or bool(re.match(r"^(\d+(\.\d+)*|[IVX]+)[.)]?\s", line)))
+
+def _page_blocks(text: str) -> list:
+    """Splits a page into ("heading" | "paragraph", text) blocks, re-joining wrapped lines."""
+    blocks = []
+    for raw in re.split(r"\n\s*\n", text):
+        paragraph = []
+        for line in raw.split("\n"):
+            line = line.strip()
+            if not line:
+                continue
+            if _is_heading(line):
+                if paragraph:
+                    blocks.append(("paragraph", " ".join(paragraph)))
+                    paragraph = []
+                blocks.append(("heading", line))
+            elif paragraph and paragraph[-1].endswith("-") and not paragraph[-1].endswith(" -"):
+                # De-hyphenate words broken across lines
+                paragraph[-1] = paragraph[-1][:-1] + line
+            else:
+                paragraph.append(line)
+        if paragraph:
+            blocks.append(("paragraph", " ".join(paragraph)))
+    return blocks
+
+def _split_long(sentence: str, limit: int) -> list:
+    """Splits an over-long sentence on word boundaries (hard-cutting only single huge tokens)."""
+    pieces, current = [], ""
+    for word in sentence.split(" "):
+        while len(word) > limit:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(word[:limit])
+            word = word[limit:]
+        if current and len(current) + 1 + len(word) > limit:
+            pieces.append(current)
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    if current:
+        pieces.append(current)
+    return pieces
+
+def structured_chunks(text: str, chunk_size: int = 1000, overlap: int = 100) -> list[str]:
+    """Splits one page into chunks that respect heading, paragraph and sentence boundaries.
+
+    Sentences are packed greedily up to `chunk_size` characters, a heading
+    starts a new chunk, and paragraphs are kept together where they fit.
+    `overlap` is a budget of characters of whole trailing sentences repeated
+    at the start of the next chunk (0 disables overlap).
+    """
+    chunks = []
+    units = []          # [(text, starts_paragraph)] in the current chunk
+    size = 0
+
+    def flush(keep_overlap: bool):
+        nonlocal units, size
+        if not units:
+            return
+        text = ""
+        for unit_text, starts_paragraph in units:
+            text += ("\n\n" if starts_paragraph else " ") + unit_text if text else unit_text
+        chunks.append(text)
+
+        kept, kept_size = [], 0
+        if keep_overlap and overlap > 0:
+            for unit in reversed(units):
+                if kept_size + len(unit[0]) > overlap:
+                    break
+                kept.insert(0, (unit[0], False))
+                kept_size += len(unit[0]) + 1
+        units, size = kept, kept_size
+
+    def add(text: str, starts_paragraph: bool):
+        nonlocal size
+        cost = len(text) + (2 if starts_paragraph else 1)
+        if units and size + cost > chunk_size:
+            flush(keep_overlap=True)
+            # Overlap never pushes a unit past the limit
+            if units and size + cost > chunk_size:
+                units.clear()
+                size = 0
+        units.append((text, starts_paragraph))
+        size += cost
+
+    blocks = _page_blocks(text or "")
+    for i, (kind, block) in enumerate(blocks):
+        if kind == "heading":
+            # Headings open a new chunk so sections are not split across chunks
+            if size >= chunk_size // 4:
+                flush(keep_overlap=False)
+            add(block, True)
+            continue
+        sentences = [s.strip() for s in _SENTENCE_END.split(block) if s.strip()]
+        # The page's last sentence may run on to the next page, so it never opens a paragraph
+        tail = None
+        if i == len(blocks) - 1 and sentences and not sentences[-1].endswith(_TERMINAL):
+            tail = sentences.pop()
+        for j, sentence in enumerate(sentences):
+            for k, piece in enumerate(_split_long(sentence, chunk_size)):
+                add(piece, j == 0 and k == 0)
+        if tail:
+            for piece in _split_long(tail, chunk_size):
+                add(piece, False)
+
+    flush(keep_overlap=False)
     return chunks
+
+FIXED = "fixed"
+STRUCTURED = "structured"
+# Page chunkers: (page text, chunk_size, overlap) -> [chunk text]
+CHUNKERS = {
+    FIXED: chunk_text,
+    STRUCTURED: structured_chunks,
+}
+
+# --- Page-anchored chunking ---------------------------------------------------
+
+def page_fingerprint(text: str) -> str:
+    return hashlib.sha256(text.strip().encode("utf-8")).hexdigest()
+
+def chunking_signature(chunker: str, chunk_size: int, overlap: int) -> str:
+    """Short hash of the chunking settings; chunks made with other settings are never reused."""
+    return hashlib.sha256(f"{chunker}:{chunk_size}:{overlap}".encode("utf-8")).hexdigest()[:8]
+
+def iter_page_chunks(pages: Iterable[tuple], chunk_size: int = 1000, overlap: int = 100, chunker: str = FIXED, known: frozenset = frozenset()) -> Iterator[dict]:
+    """Chunks every page on its own, so a page's chunks depend only on that page's text.
+
+    Yields {"page", "page_hash", "chunks"} for each page with text. Pages whose
+    fingerprint is in `known` are not re-chunked ("chunks" is None); their
+    chunks are already stored.
+    """
+    for page_number, page_text in pages:
+        if not page_text or not page_text.strip():
+            continue
+        page_hash = page_fingerprint(page_text)
+        chunks = None
+        if page_hash not in known:
+            chunks = [chunk for chunk in CHUNKERS[chunker](page_text, chunk_size, overlap) if chunk.strip()]
+        yield {"page": page_number, "page_hash": page_hash, "chunks": chunks}
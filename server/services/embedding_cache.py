@@ -0,0 +1,182 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+from array import array
+from collections import OrderedDict
+
+# Content-addressed embedding cache.
+# Memory tier: bounded LRU of recently used vectors.
+# Disk tier: SQLite table of float32 blobs that survives restarts.
+# Keys are sha256(model + text), so identical chunks from re-uploaded PDFs,
+# the seed text and repeated user queries are only embedded once.
+# Disk reads and writes run in a worker thread, off the event loop.
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CACHE_PATH = os.path.join(SERVER_DIR, ".cache", "embeddings.sqlite3")
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+# Set to an empty string to keep the cache in memory only
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH)
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, max_items: int = EMBEDDING_CACHE_SIZE, db_path: str = EMBEDDING_CACHE_PATH):
+        self.max_items = max_items
+        self.db_path = db_path
+        self._memory = OrderedDict()
+        self._db = None
+        self._db_lock = asyncio.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if db_path:
+            self._open_db()
+
+    def _open_db(self):
+        try:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._db.commit()
+        except Exception as e:
+            print(f"Embedding cache disk tier disabled: {e}")
+            logging.error(f"Embedding Cache DB Error: {e}", exc_info=True)
+            self._db = None
+
+    def _remember(self, key: str, vector: list):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _load_from_disk(self, keys: list) -> dict:
+        """Blocking: reads vectors by key (runs in a worker thread)."""
+        found = {}
+        try:
+            # Stay well below SQLite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", part
+                ).fetchall()
+                for key, blob in rows:
+                    vec = array("f")
+                    vec.frombytes(blob)
+                    found[key] = vec.tolist()
+        except Exception as e:
+            logging.error(f"Embedding Cache Read Error: {e}")
+        return found
+
+    def _write_to_disk(self, rows: list):
+        """Blocking: stores (key, blob) rows (runs in a worker thread)."""
+        try:
+            self._db.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            self._db.commit()
+        except Exception as e:
+            logging.error(f"Embedding Cache Write Error: {e}")
+
+    async def get_many(self, model: str, texts: list) -> list:
+        """Returns a list aligned with texts; None marks a miss."""
+        keys = [cache_key(model, t) for t in texts]
+        results = [None] * len(texts)
+        pending = {}
+
+        for i, key in enumerate(keys):
+            vec = self._memory.get(key)
+            if vec is not None:
+                self._memory.move_to_end(key)
+                results[i] = vec
+                self.hits += 1
+            else:
+                pending.setdefault(key, []).append(i)
+
+        if pending:
+            from_disk = {}
+            async with self._db_lock:
+                if self._db:
+                    from_disk = await asyncio.to_thread(self._load_from_disk, list(pending.keys()))
+            for key, indices in pending.items():
+                vec = from_disk.get(key)
+                if vec is None:
+                    self.misses += len(indices)
+                    continue
+                self._remember(key, vec)
+                for i in indices:
+                    results[i] = vec
+                self.hits += len(indices)
+                self.disk_hits += len(indices)
+
+        return results
+
+    async def get(self, model: str, text: str):
+        return (await self.get_many(model, [text]))[0]
+
+    async def put_many(self, model: str, texts: list, vectors: list):
+        rows = []
+        for text, vec in zip(texts, vectors):
+            if not vec:
+                continue
+            key = cache_key(model, text)
+            self._remember(key, vec)
+            rows.append((key, array("f", vec).tobytes()))
+
+        if rows:
+            async with self._db_lock:
+                if self._db:
+                    await asyncio.to_thread(self._write_to_disk, rows)
+
+    async def put(self, model: str, text: str, vector: list):
+        await self.put_many(model, [text], [vector])
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "memory_items": len(self._memory),
+            "max_items": self.max_items,
+            "disk_enabled": self._db is not None,
+        }
+
+    async def close(self):
+        async with self._db_lock:
+            if self._db:
+                self._db.close()
+                self._db = None
+
+
+_cache = None
+
+
+def get_embedding_cache():
+    """Returns the process-wide cache, or None when caching is disabled."""
+    global _cache
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = EmbeddingCache()
+    return _cache
+
+
+async def close_embedding_cache():
+    global _cache
+    if _cache is not None:
+        cache, _cache = _cache, None
+        await cache.close()
@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import os
+
+from services.http_clients import get_gemini_client
+from services.embedding_cache import get_embedding_cache
+from services.rate_limiter import RateLimiter, estimate_tokens
+from services.single_flight import SingleFlight
+from services.metrics import span, count
+
+# Configure Gemini (REST)
+api_key = os.getenv("GEMINI_API_KEY")
+
+if not api_key:
+    print("WARNING: GEMINI_API_KEY not found. Embeddings will fail.")
+
+# Gemini text-embedding-004 is 768 dims
+EMBEDDING_MODEL = "models/text-embedding-004"
+EMBEDDING_DIM = 768
+
+GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta"
+
+# batchEmbedContents accepts at most 100 requests per call
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+# Max batchEmbedContents calls in flight across the whole process
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", "4"))
+# Client-side pacing (0 disables a limit)
+EMBED_RPM = float(os.getenv("EMBED_RPM", "1500"))
+EMBED_TPM = float(os.getenv("EMBED_TPM", "1000000"))
+
+# Opt-in micro-batching of concurrent query embeddings (0 disables)
+EMBED_COALESCE_WINDOW_MS = float(os.getenv("EMBED_COALESCE_WINDOW_MS", "0"))
+EMBED_COALESCE_MAX_BATCH = int(os.getenv("EMBED_COALESCE_MAX_BATCH", "32"))
+
+MAX_ATTEMPTS = 5
+
+rate_limiter = RateLimiter(requests_per_minute=EMBED_RPM, tokens_per_minute=EMBED_TPM)
+_batch_semaphore = asyncio.Semaphore(EMBED_MAX_CONCURRENCY)
+# Concurrent requests to embed the same query share one call
+query_embedding_flight = SingleFlight()
+
+
+def _retry_after(resp, attempt: int) -> float:
+    header = resp.headers.get("retry-after")
+    if header:
+        try:
+            return min(60.0, float(header))
+        except ValueError:
+            pass
+    return min(60, 2 * (2 ** attempt)) # 2, 4, 8, 16, 32
+
+
+async def get_embeddings(texts):
+    """Generates embeddings using Gemini REST API (Batch), served from the embedding cache when possible.
+
+    Returns None unless every text was embedded. Vectors from batches that did
+    succeed are still cached, so a retry only re-embeds the failed batches.
+    """
+    if not api_key:
+        return None
+    if isinstance(texts, str):
+        texts = [texts]
+
+    cache = get_embedding_cache()
+    if cache is None:
+        embeddings = await _fetch_embeddings(texts)
+        return None if any(vec is None for vec in embeddings) else embeddings
+
+    embeddings = await cache.get_many(EMBEDDING_MODEL, texts)
+    missing = [i for i, vec in enumerate(embeddings) if vec is None]
+    if missing:
+        # Identical texts inside one request are only embedded once
+        unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+        fetched = await _fetch_embeddings(unique_texts)
+        embedded = [(text, vec) for text, vec in zip(unique_texts, fetched) if vec is not None]
+        if embedded:
+            await cache.put_many(EMBEDDING_MODEL, [text for text, _ in embedded], [vec for _, vec in embedded])
+        if len(embedded) != len(unique_texts):
+            return None
+        by_text = dict(embedded)
+        for i in missing:
+            embeddings[i] = by_text[texts[i]]
+    return embeddings
+
+async def _fetch_embeddings(texts: list):
+    """Splits texts into API-sized batches, embeds them concurrently and returns vectors in input order.
+
+    A batch that fails leaves None in place of each of its vectors; the other
+    batches' vectors are kept.
+    """
+    batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+    if not batches:
+        return []
+
+    results = await asyncio.gather(*[_fetch_embedding_batch(batch) for batch in batches], return_exceptions=True)
+
+    embeddings = []
+    failed = 0
+    for batch, vectors in zip(batches, results):
+        if isinstance(vectors, BaseException) or not vectors or len(vectors) != len(batch):
+            if isinstance(vectors, BaseException):
+                logging.error(f"Embedding Batch Error: {vectors}")
+            failed += 1
+            embeddings.extend([None] * len(batch))
+        else:
+            embeddings.extend(vectors)
+    if failed:
+        print(f"Embedding: {failed}/{len(batches)} batches failed")
+    return embeddings
+
+async def _fetch_embedding_batch(texts: list):
+    try:
+        # Batch Embed URL
+        url = f"{GEMINI_API_URL}/{EMBEDDING_MODEL}:batchEmbedContents?key={api_key}"
+
+        requests = [{"model": EMBEDDING_MODEL, "content": {"parts": [{"text": t}]}} for t in texts]
+        payload = {"requests": requests}
+        tokens = sum(estimate_tokens(t) for t in texts)
+
+        client = get_gemini_client()
+        async with _batch_semaphore:
+            for attempt in range(MAX_ATTEMPTS):
+                # Includes waits imposed by earlier 429s (rate_limiter.pause)
+                with span("rate_limit_wait", upstream="gemini_embed"):
+                    await rate_limiter.acquire(tokens)
+                try:
+                    with span("embed", {"texts": len(texts), "attempt": attempt + 1}, kind="batch") as s:
+                        resp = await client.post(url, json=payload, timeout=60.0)
+                        s.set(status=resp.status_code)
+                    if resp.status_code == 200:
+                        result = resp.json()
+                        return [e['values'] for e in result.get('embeddings', [])]
+                    elif resp.status_code == 429:
+                        wait_time = _retry_after(resp, attempt)
+                        count("upstream_retries_total", upstream="gemini_embed", reason="429")
+                        print(f"Embedding 429. Pausing embedding calls for {wait_time}s...")
+                        rate_limiter.pause(wait_time)
+                        continue
+                    else:
+                        print(f"Embedding Batch Error {resp.status_code}: {resp.text}")
+                        logging.error(f"Embedding Batch API Error: {resp.text}")
+                        return None
+                except Exception as e:
+                     logging.error(f"Connection Error: {e}")
+                     if attempt == MAX_ATTEMPTS - 1: raise e
+        return None
+
+    except Exception as e:
+        print(f"Error generating embeddings: {e}")
+        logging.error(f"Embedding Gen Error: {e}", exc_info=True)
+        return None
+
+async def get_query_embedding(text):
+    if not api_key:
+        return None
+
+    cache = get_embedding_cache()
+    if cache is not None:
+        cached = await cache.get(EMBEDDING_MODEL, text)
+        if cached is not None:
+            return cached
+
+    embedding = await query_embedding_flight.do(text, lambda: _embed_query(text))
+    if embedding and cache is not None:
+        await cache.put(EMBEDDING_MODEL, text, embedding)
+    return embedding
+
+async def _embed_query(text: str):
+    if query_coalescer is not None:
+        return await query_coalescer.embed(text)
+    return await _fetch_query_embedding(text)
+
+async def _fetch_query_embedding(text: str):
+    try:
+        # Single Embed URL
+        url = f"{GEMINI_API_URL}/{EMBEDDING_MODEL}:embedContent?key={api_key}"
+        payload = {
+            "model": EMBEDDING_MODEL,
+            "content": {"parts": [{"text": text}]}
+        }
+
+        client = get_gemini_client()
+        for attempt in range(MAX_ATTEMPTS):
+            with span("rate_limit_wait", upstream="gemini_embed"):
+                await rate_limiter.acquire(estimate_tokens(text))
+            try:
+                with span("embed", {"texts": 1, "attempt": attempt + 1}, kind="query") as s:
+                    resp = await client.post(url, json=payload, timeout=30.0)
+                    s.set(status=resp.status_code)
+                if resp.status_code == 200:
+                     result = resp.json()
+                     return result['embedding']['values']
+                elif resp.status_code == 429:
+                    wait_time = _retry_after(resp, attempt)
+                    count("upstream_retries_total", upstream="gemini_embed", reason="429")
+                    print(f"Query Embedding 429. Pausing embedding calls for {wait_time}s...")
+                    rate_limiter.pause(wait_time)
+                    continue
+                else:
+                    print(f"Query Embed Error {resp.status_code}: {resp.text}")
+                    logging.error(f"Query API Error: {resp.text}")
+                    return None
+            except Exception as e:
+                 logging.error(f"Connect Error: {e}")
+                 if attempt == MAX_ATTEMPTS - 1: return None
+        return None
+
+    except Exception as e:
+        print(f"Error generating query embedding: {e}")
+        logging.error(f"Query Embedding Error: {e}", exc_info=True)
+        return None
+
+class QueryEmbeddingCoalescer:
+    """Gathers query embeddings that arrive within a short window into one batchEmbedContents call.
+
+    The first request in an empty window starts a timer; the batch is sent when
+    the timer fires or as soon as `max_batch` requests are waiting. Each caller
+    gets back only its own vector (or None if the batch failed).
+    """
+
+    def __init__(self, window_ms: float, max_batch: int):
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._pending = []
+        self._timer = None
+        self._inflight = set()
+        self.batches = 0
+        self.requests = 0
+
+    async def embed(self, text: str):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        self.requests += 1
+
+        if len(self._pending) >= self.max_batch:
+            self._flush_now()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush_now)
+        return await future
+
+    def _flush_now(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            self.batches += 1
+            task = asyncio.ensure_future(self._send(batch))
+            # Keep a reference so the task is not garbage collected mid-flight
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, batch: list):
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            vectors = await _fetch_embeddings(texts)
+        except Exception as e:
+            logging.error(f"Coalesced Query Embedding Error: {e}", exc_info=True)
+            vectors = None
+
+        by_text = dict(zip(texts, vectors)) if vectors else {}
+        for text, future in batch:
+            if not future.done():
+                future.set_result(by_text.get(text))
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+query_coalescer = (
+    QueryEmbeddingCoalescer(EMBED_COALESCE_WINDOW_MS, EMBED_COALESCE_MAX_BATCH)
+    if EMBED_COALESCE_WINDOW_MS > 0 else None
+)
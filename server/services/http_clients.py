@@ -0,0 +1,83 @@
+import logging
+import os
+
+import httpx
+
+# Shared, process-wide HTTP clients (one per upstream).
+# Created in the FastAPI startup hook and closed on shutdown so every
+# service call reuses pooled keep-alive connections instead of paying a
+# fresh TCP/TLS handshake per request.
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))
+# HTTP/2 needs the optional `h2` package (pip install httpx[http2])
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() in ("1", "true", "yes")
+
+CHROMA = "chroma"
+GEMINI = "gemini"
+LLM = "llm"
+
+_clients = {}
+
+
+def _http2_available() -> bool:
+    if not HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        print("WARNING: HTTP2_ENABLED is set but the 'h2' package is not installed. Falling back to HTTP/1.1.")
+        return False
+
+
+def _build_client(name: str) -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+    # Chroma is a plain-HTTP local service, HTTP/2 only helps the TLS upstreams
+    http2 = name != CHROMA and _http2_available()
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2)
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """Returns the shared client for an upstream, creating it lazily if needed."""
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _build_client(name)
+        _clients[name] = client
+    return client
+
+
+def get_chroma_client() -> httpx.AsyncClient:
+    return get_client(CHROMA)
+
+
+def get_gemini_client() -> httpx.AsyncClient:
+    return get_client(GEMINI)
+
+
+def get_llm_client() -> httpx.AsyncClient:
+    return get_client(LLM)
+
+
+async def init_clients():
+    """Creates the pooled clients. Called from the app startup hook."""
+    for name in (CHROMA, GEMINI, LLM):
+        get_client(name)
+
+
+async def close_clients():
+    """Closes every pooled client. Called from the app shutdown hook."""
+    for name, client in list(_clients.items()):
+        try:
+            await client.aclose()
+        except Exception as e:
+            logging.error(f"Error closing HTTP client '{name}': {e}")
+    _clients.clear()
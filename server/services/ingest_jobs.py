@@ -0,0 +1,262 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import update
+from sqlalchemy.future import select
+
+from database import async_session
+from models.ingest_job import IngestJob
+from services.ingestion import plan_pdf, store_plan, finish_source, source_lock, IngestError
+from services.uploads import remove_spool_file
+
+# Uploads are ingested by background workers instead of inside the request.
+# Jobs are persisted in the `ingest_jobs` table and their spool files are kept
+# on disk until the job finishes, so queued or interrupted jobs are resumed on
+# the next startup. Resuming is cheap: plan_pdf skips pages whose chunks were
+# all stored by the interrupted run.
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INGEST_SPOOL_DIR = os.getenv("INGEST_SPOOL_DIR", os.path.join(SERVER_DIR, ".cache", "ingest"))
+# Number of jobs processed concurrently, independent of the API worker count
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# A job that keeps getting interrupted (e.g. it crashes the server) is failed after this many starts
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+# Minimum seconds between progress writes to the database
+INGEST_PROGRESS_INTERVAL = float(os.getenv("INGEST_PROGRESS_INTERVAL", "1.0"))
+# Finished jobs kept in memory for status lookups; older ones are read from the database
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "1000"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+_queue = None
+_workers = []
+_jobs = {}  # job id -> state of jobs known to this process
+
+
+def _state(job: IngestJob) -> dict:
+    return {
+        "id": job.id,
+        "source": job.source,
+        "spool_path": job.spool_path,
+        "options": job.options or {},
+        "status": job.status,
+        "stage": job.stage,
+        "chunks_total": job.chunks_total or 0,
+        "chunks_done": job.chunks_done or 0,
+        "chunks_failed": job.chunks_failed or 0,
+        "attempts": job.attempts or 0,
+        "result": job.result,
+        "error": job.error,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+    }
+
+
+def job_status(state: dict) -> dict:
+    """Public view of a job for the status endpoint."""
+    total = state["chunks_total"]
+    return {
+        "job_id": state["id"],
+        "source": state["source"],
+        "status": state["status"],
+        "stage": state["stage"],
+        "chunks_total": total,
+        "chunks_done": state["chunks_done"],
+        "chunks_failed": state["chunks_failed"],
+        "progress": round(state["chunks_done"] / total, 4) if total else (1.0 if state["status"] == DONE else 0.0),
+        "attempts": state["attempts"],
+        "result": state["result"],
+        "error": state["error"],
+        "created_at": state["created_at"],
+        "updated_at": state["updated_at"],
+    }
+
+
+async def _save(job_id: str, persist: bool = True, **fields):
+    """Updates a job in memory and (unless `persist` is False) in the database."""
+    now = datetime.utcnow()
+    _jobs[job_id].update(fields, updated_at=now)
+    if not persist:
+        return
+    try:
+        async with async_session() as session:
+            await session.execute(update(IngestJob).where(IngestJob.id == job_id).values(**fields, updated_at=now))
+            await session.commit()
+    except Exception as e:
+        logging.error(f"Ingest Job Save Error ({job_id}): {e}")
+
+
+async def enqueue_ingest_job(source: str, spool_path: str, options: dict) -> dict:
+    """Records a job for a spooled upload and queues it. Returns the job state."""
+    now = datetime.utcnow()
+    job = IngestJob(
+        id=str(uuid.uuid4()),
+        source=source,
+        spool_path=spool_path,
+        options=options,
+        status=QUEUED,
+        stage=QUEUED,
+        chunks_total=0,
+        chunks_done=0,
+        chunks_failed=0,
+        attempts=0,
+        created_at=now,
+        updated_at=now,
+    )
+    try:
+        async with async_session() as session:
+            session.add(job)
+            await session.commit()
+    except Exception as e:
+        # The job still runs; it just won't be resumed after a restart
+        print(f"Failed to persist ingest job for {source}: {e}")
+        logging.error(f"Ingest Job Persist Error ({source}): {e}", exc_info=True)
+
+    state = _state(job)
+    _jobs[job.id] = state
+    start_ingest_workers()
+    _queue.put_nowait(job.id)
+    return state
+
+
+async def get_ingest_job(job_id: str):
+    """Returns the job state, or None if the job doesn't exist."""
+    if job_id in _jobs:
+        return _jobs[job_id]
+    async with async_session() as session:
+        result = await session.execute(select(IngestJob).where(IngestJob.id == job_id))
+        job = result.scalar_one_or_none()
+    return _state(job) if job else None
+
+
+async def _run_job(job_id: str):
+    job = _jobs[job_id]
+    options = job["options"]
+    attempts = job["attempts"] + 1
+    if attempts > INGEST_MAX_ATTEMPTS:
+        await _save(job_id, status=FAILED, stage=FAILED, error=f"Gave up after {INGEST_MAX_ATTEMPTS} interrupted attempts")
+        remove_spool_file(job["spool_path"])
+        return
+
+    await _save(job_id, status=RUNNING, stage="parsing", attempts=attempts, error=None)
+    try:
+        # One ingest per source at a time (see ingestion.source_lock)
+        async with source_lock(job["source"]):
+            # Only pages that changed since the last ingest of this source are chunked and embedded
+            plan = await plan_pdf(
+                job["source"],
+                job["spool_path"],
+                options.get("chunk_size", 1000),
+                options.get("chunk_overlap", 100),
+                options.get("chunker", "fixed"),
+            )
+            total_chunks = plan["chunks"]
+
+            # Chunks that were already stored count as done from the start
+            unchanged = total_chunks - len(plan["new"]["ids"])
+            await _save(job_id, stage="embedding", chunks_total=total_chunks, chunks_done=unchanged, chunks_failed=0)
+            last_write = time.monotonic()
+
+            async def on_progress(stored: int, failed: int, total: int):
+                nonlocal last_write
+                persist = time.monotonic() - last_write >= INGEST_PROGRESS_INTERVAL
+                if persist:
+                    last_write = time.monotonic()
+                await _save(job_id, persist=persist, chunks_done=unchanged + stored, chunks_failed=failed)
+
+            try:
+                stored = await store_plan(plan, on_progress=on_progress)
+                report = await finish_source(plan, stored["stored"], stored["failed_pages"], stored["failed_ids"])
+            except Exception as e:
+                raise IngestError(f"Error storing embeddings: {e}")
+
+        if report["new"] and report["stored"] == 0:
+            errors = "; ".join(f["error"] for f in report["failed_pages"][:3])
+            raise IngestError(f"Error storing embeddings: {errors}")
+
+        message = "File processed and indexed successfully"
+        if report["failed_pages"]:
+            message = f"File partially indexed: {len(report['failed_pages'])} pages failed"
+        await _save(
+            job_id,
+            status=DONE,
+            stage=DONE,
+            chunks_done=unchanged + stored["stored"],
+            chunks_failed=stored["failed"],
+            result={"message": message, "chunker": options.get("chunker", "fixed"), **report},
+        )
+    except asyncio.CancelledError:
+        # Shutdown: keep the spool file and the running status so the job is resumed
+        raise
+    except Exception as e:
+        print(f"Ingest job {job_id} ({job['source']}) failed: {e}")
+        logging.error(f"Ingest Job Error ({job_id}): {e}", exc_info=not isinstance(e, IngestError))
+        await _save(job_id, status=FAILED, stage=FAILED, error=str(e))
+        remove_spool_file(job["spool_path"])
+    else:
+        remove_spool_file(job["spool_path"])
+
+
+def _prune_finished():
+    finished = [job_id for job_id, state in _jobs.items() if state["status"] in (DONE, FAILED)]
+    for job_id in finished[:max(0, len(finished) - INGEST_JOB_HISTORY)]:
+        del _jobs[job_id]
+
+
+async def _worker():
+    while True:
+        job_id = await _queue.get()
+        try:
+            await _run_job(job_id)
+            _prune_finished()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Ingest Worker Error ({job_id}): {e}", exc_info=True)
+        finally:
+            _queue.task_done()
+
+
+def start_ingest_workers():
+    global _queue
+    if _queue is None:
+        _queue = asyncio.Queue()
+    _workers[:] = [task for task in _workers if not task.done()]
+    while len(_workers) < INGEST_WORKERS:
+        _workers.append(asyncio.create_task(_worker()))
+
+
+async def resume_ingest_jobs() -> int:
+    """Starts the workers and re-queues jobs left queued or running by a previous process."""
+    start_ingest_workers()
+    async with async_session() as session:
+        result = await session.execute(
+            select(IngestJob).where(IngestJob.status.in_([QUEUED, RUNNING])).order_by(IngestJob.created_at)
+        )
+        jobs = result.scalars().all()
+    resumed = 0
+    for job in jobs:
+        if job.id in _jobs:
+            continue
+        _jobs[job.id] = _state(job)
+        if not job.spool_path or not os.path.exists(job.spool_path):
+            await _save(job.id, status=FAILED, stage=FAILED, error="Upload file was lost before the job could run")
+            continue
+        _queue.put_nowait(job.id)
+        resumed += 1
+    return resumed
+
+
+async def stop_ingest_workers():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
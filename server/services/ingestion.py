@@ -0,0 +1,225 @@
+import asyncio
+import hashlib
+import logging
+import weakref
+
+from services.vector_backend import get_vector_store
+from services.vector_store import add_documents, delete_documents, update_metadata
+from services.document_processor import chunking_signature, iter_page_chunks, FIXED
+from services.parse_pool import parse_pdf_pages
+
+# A plan describes what (re)indexing one source requires:
+#   {"source", "chunks": total chunk count,
+#    "new": {"ids", "documents", "metadatas"}      - chunks to embed and store,
+#    "updates": {"ids", "metadatas"}               - stored chunks whose metadata moved,
+#    "removed_ids": [...]                          - stored chunks the source no longer has,
+#    "removed_pages": {id: page number}            - page each removed chunk was on,
+#    "pages": {"total", "changed", "unchanged", "removed"} or None}
+# Re-indexing a source is plan -> store_plan -> finish_source, run under
+# source_lock(source): two interleaved runs for one source would each delete
+# the other's freshly stored chunks as stale.
+
+
+class IngestError(Exception):
+    """An ingest failure whose message is reported to the client as-is."""
+
+
+def _source_key(source: str) -> str:
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:12]
+
+
+def page_chunk_id(source: str, signature: str, page_hash: str, index: int) -> str:
+    """Id of the index-th chunk of a page; stable as long as the page text and chunking settings are."""
+    return f"{_source_key(source)}-{signature}-{page_hash[:16]}-{index}"
+
+
+_source_locks = weakref.WeakValueDictionary()
+
+
+def source_lock(source: str) -> asyncio.Lock:
+    """Lock to hold from planning a source until finish_source has run for it."""
+    lock = _source_locks.get(source)
+    if lock is None:
+        lock = _source_locks[source] = asyncio.Lock()
+    return lock
+
+
+def _empty_plan(source: str) -> dict:
+    return {
+        "source": source,
+        "chunks": 0,
+        "new": {"ids": [], "documents": [], "metadatas": []},
+        "updates": {"ids": [], "metadatas": []},
+        "removed_ids": [],
+        "removed_pages": {},
+        "pages": None,
+    }
+
+
+async def load_source_state(source: str) -> dict:
+    """Returns {id: metadata} for every chunk currently stored for `source`."""
+    existing = await get_vector_store().get(where={"source": source}, include_documents=False)
+    return dict(zip(existing["ids"], existing["metadatas"]))
+
+
+def known_pages(existing: dict, signature: str) -> frozenset:
+    """Fingerprints of pages whose chunks (made with `signature`) are all stored."""
+    stored, expected = {}, {}
+    for meta in existing.values():
+        meta = meta or {}
+        if meta.get("chunking") != signature or "page_hash" not in meta:
+            continue
+        stored[meta["page_hash"]] = stored.get(meta["page_hash"], 0) + 1
+        expected[meta["page_hash"]] = meta.get("page_chunks")
+    return frozenset(h for h, count in stored.items() if count == expected[h])
+
+
+def plan_pages(source: str, pages: list, existing: dict, signature: str, overlap: int = None) -> dict:
+    """Diffs page-anchored chunks (from parse_pdf_pages) against the stored chunks.
+
+    Only pages whose fingerprint changed carry chunk texts, so only those are
+    embedded. Unchanged pages that moved get a metadata update, and chunks of
+    changed or removed pages are scheduled for deletion. A page repeated
+    verbatim is stored once. `overlap` (the chunking overlap, in characters)
+    is recorded on each chunk so context assembly knows how much two
+    neighbours can share.
+    """
+    stored_page_chunks = {
+        meta["page_hash"]: meta["page_chunks"]
+        for meta in existing.values()
+        if meta and meta.get("chunking") == signature and "page_hash" in meta
+    }
+    plan = _empty_plan(source)
+    wanted_ids = set()
+    seen = set()
+    changed = unchanged = 0
+    index = 0
+    for page in pages:
+        page_hash = page["page_hash"]
+        if page_hash in seen:
+            continue
+        seen.add(page_hash)
+
+        if page["chunks"] is None:
+            # Known page: its chunks are already stored
+            texts = [None] * stored_page_chunks[page_hash]
+            unchanged += 1
+        else:
+            texts = page["chunks"]
+            changed += 1
+
+        for i, text in enumerate(texts):
+            id_ = page_chunk_id(source, signature, page_hash, i)
+            meta = {
+                "source": source,
+                "chunk": index,
+                "page_start": page["page"],
+                "page_end": page["page"],
+                "page_hash": page_hash,
+                "page_chunks": len(texts),
+                "chunking": signature,
+            }
+            if overlap is not None:
+                meta["chunk_overlap"] = overlap
+            index += 1
+            wanted_ids.add(id_)
+            if id_ not in existing:
+                plan["new"]["ids"].append(id_)
+                plan["new"]["documents"].append(text)
+                plan["new"]["metadatas"].append(meta)
+            elif existing[id_] != meta:
+                plan["updates"]["ids"].append(id_)
+                plan["updates"]["metadatas"].append(meta)
+
+    plan["chunks"] = index
+    plan["removed_ids"] = [id_ for id_ in existing if id_ not in wanted_ids]
+    plan["removed_pages"] = {id_: (existing[id_] or {}).get("page_start") for id_ in plan["removed_ids"]}
+    old_pages = {(meta or {}).get("page_hash") for meta in existing.values()} - {None}
+    plan["pages"] = {
+        "total": len(seen),
+        "changed": changed,
+        "unchanged": unchanged,
+        "removed": len(old_pages - seen),
+    }
+    return plan
+
+
+async def plan_pdf(source: str, path: str, chunk_size: int = 1000, overlap: int = 100, chunker: str = FIXED) -> dict:
+    """Plans re-indexing a PDF, re-chunking only pages whose fingerprint changed."""
+    signature = chunking_signature(chunker, chunk_size, overlap)
+    try:
+        existing = await load_source_state(source)
+    except Exception as e:
+        raise IngestError(f"Error reading existing chunks: {e}")
+    try:
+        pages = await parse_pdf_pages(path, chunk_size, overlap, chunker, known_pages(existing, signature))
+    except Exception as e:
+        raise IngestError(f"PDF Processing Error: {e}")
+    if not pages:
+        raise IngestError("Failed to extract text. The PDF might be a scanned image or empty. Please upload a text-based PDF.")
+    return plan_pages(source, pages, existing, signature, overlap)
+
+
+async def plan_text(source: str, pages: list, chunk_size: int = 1000, overlap: int = 100, chunker: str = FIXED) -> dict:
+    """Plans re-indexing already extracted [(page number, text)], chunked in-process (for small texts such as seed data)."""
+    signature = chunking_signature(chunker, chunk_size, overlap)
+    try:
+        existing = await load_source_state(source)
+    except Exception as e:
+        raise IngestError(f"Error reading existing chunks: {e}")
+    parsed = list(iter_page_chunks(pages, chunk_size, overlap, chunker, known_pages(existing, signature)))
+    if not parsed:
+        raise IngestError("No text to index")
+    return plan_pages(source, parsed, existing, signature, overlap)
+
+
+async def store_plan(plan: dict, on_progress=None) -> dict:
+    """Embeds and stores the plan's new chunks. Returns add_documents' report."""
+    new = plan["new"]
+    if not new["ids"]:
+        return {"stored": 0, "failed": 0, "pages": 0, "failed_pages": [], "failed_ids": []}
+    return await add_documents(
+        documents=new["documents"],
+        metadatas=new["metadatas"],
+        ids=new["ids"],
+        on_progress=on_progress,
+    )
+
+
+async def finish_source(plan: dict, stored: int, failed_pages: list, failed_ids=()) -> dict:
+    """Deletes stale chunks, applies metadata updates and builds the ingest report.
+
+    `failed_ids` are the new chunk ids that could not be stored. Stale chunks
+    on a page whose new chunks were not all stored are kept, so a failed
+    re-ingest never loses a page's content; the next ingest retries the page.
+    """
+    source = plan["source"]
+    failed_ids = set(failed_ids)
+    unstored_pages = {
+        meta["page_start"]
+        for id_, meta in zip(plan["new"]["ids"], plan["new"]["metadatas"])
+        if id_ in failed_ids
+    }
+    removed_ids = [id_ for id_ in plan["removed_ids"] if plan["removed_pages"].get(id_) not in unstored_pages]
+    try:
+        if removed_ids:
+            await delete_documents(ids=removed_ids)
+        await update_metadata(plan["updates"]["ids"], plan["updates"]["metadatas"])
+    except Exception as e:
+        print(f"Failed to clean up stale chunks of {source}: {e}")
+        logging.error(f"Stale Chunk Cleanup Error ({source}): {e}", exc_info=True)
+        raise
+
+    report = {
+        "source": source,
+        "chunks": plan["chunks"],
+        "new": len(plan["new"]["ids"]),
+        "unchanged": plan["chunks"] - len(plan["new"]["ids"]),
+        "removed": len(removed_ids),
+        "kept_stale": len(plan["removed_ids"]) - len(removed_ids),
+        "stored": stored,
+        "failed_pages": failed_pages,
+    }
+    if plan["pages"] is not None:
+        report["pages"] = plan["pages"]
+    return report
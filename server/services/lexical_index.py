@@ -0,0 +1,121 @@
+import heapq
+import math
+import os
+import re
+from collections import Counter
+
+from services.vector_backend import matches_where
+
+# In-memory BM25 index over the same chunks stored in the vector backend.
+# Lexical queries need no embedding call and no network round trip, so they
+# keep knowledgeBase nodes answering when Gemini is slow or rate-limited at
+# query time. Chunks are only indexed once they have been embedded and stored
+# (the index is rebuilt from the vector store on startup), so documents still
+# need Gemini to be ingested.
+
+LEXICAL_INDEX_ENABLED = os.getenv("LEXICAL_INDEX_ENABLED", "true").lower() in ("1", "true", "yes")
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have in is it its of on or that the this to was were will with".split()
+)
+
+
+def tokenize(text: str) -> list:
+    return [t for t in _TOKEN_RE.findall((text or "").lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """Incrementally maintained inverted index with Okapi BM25 scoring."""
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}   # term -> {doc_id: term frequency}
+        self._lengths = {}    # doc_id -> token count
+        self._documents = {}  # doc_id -> (text, metadata)
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._documents)
+
+    def add(self, ids: list, documents: list, metadatas: list):
+        """Adds or replaces documents."""
+        metadatas = metadatas or [None] * len(ids)
+        for doc_id, text, meta in zip(ids, documents, metadatas):
+            if doc_id in self._documents:
+                self._remove(doc_id)
+            tokens = tokenize(text)
+            for term, tf in Counter(tokens).items():
+                self._postings.setdefault(term, {})[doc_id] = tf
+            self._lengths[doc_id] = len(tokens)
+            self._total_length += len(tokens)
+            self._documents[doc_id] = (text, meta or {})
+
+    def update_metadata(self, ids: list, metadatas: list):
+        for doc_id, meta in zip(ids, metadatas):
+            if doc_id in self._documents:
+                self._documents[doc_id] = (self._documents[doc_id][0], meta or {})
+
+    def _remove(self, doc_id: str):
+        text, _ = self._documents.pop(doc_id)
+        for term in set(tokenize(text)):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._lengths.pop(doc_id, 0)
+
+    def remove(self, ids: list = None, where: dict = None):
+        if ids is None:
+            if not where:
+                return
+            ids = list(self._documents.keys())
+        for doc_id in ids:
+            if doc_id in self._documents and (not where or matches_where(self._documents[doc_id][1], where)):
+                self._remove(doc_id)
+
+    def clear(self):
+        self.__init__(self.k1, self.b)
+
+    def search(self, query: str, n_results: int = 3, where: dict = None) -> list:
+        """Returns [(doc_id, score, text, metadata)] best first."""
+        if not self._documents:
+            return []
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+
+        n_docs = len(self._documents)
+        avg_length = self._total_length / n_docs if n_docs else 0.0
+        scores = {}
+        for term in terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / avg_length) if avg_length else self.k1
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        if where:
+            scores = {d: s for d, s in scores.items() if matches_where(self._documents[d][1], where)}
+
+        best = heapq.nlargest(n_results, scores.items(), key=lambda item: item[1])
+        return [(doc_id, score, *self._documents[doc_id]) for doc_id, score in best]
+
+
+_index = None
+
+
+def get_lexical_index():
+    """Returns the process-wide BM25 index, or None when disabled."""
+    global _index
+    if not LEXICAL_INDEX_ENABLED:
+        return None
+    if _index is None:
+        _index = BM25Index()
+    return _index
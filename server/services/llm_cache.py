@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Two-tier cache of llmEngine answers.
+# Exact tier: bounded TTL/LRU keyed by (model, system prompt, context, query).
+# Semantic tier (opt-in): reuses an answer when the query embedding is within
+# LLM_SEMANTIC_MAX_DISTANCE (cosine distance) of a cached query that was
+# answered by the same model and prompt from the same retrieved chunks.
+# Retrieved context is part of every key, so re-indexed documents produce new
+# keys instead of serving answers built from stale chunks.
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1000"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+LLM_SEMANTIC_CACHE_ENABLED = os.getenv("LLM_SEMANTIC_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+LLM_SEMANTIC_MAX_DISTANCE = float(os.getenv("LLM_SEMANTIC_MAX_DISTANCE", "0.05"))
+LLM_SEMANTIC_CACHE_SIZE = int(os.getenv("LLM_SEMANTIC_CACHE_SIZE", "500"))
+
+
+def _digest(value) -> str:
+    payload = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def exact_key(model: str, system_prompt: str, context: str, query: str) -> str:
+    return _digest([model, system_prompt, context, query])
+
+
+def sources_key(model: str, system_prompt: str, chunk_ids: list) -> str:
+    """Groups semantic entries: same model and prompt, same retrieved chunks (in any order)."""
+    return _digest([model, system_prompt, sorted(str(chunk_id) for chunk_id in chunk_ids)])
+
+
+class LLMResponseCache:
+    def __init__(
+        self,
+        max_items: int = LLM_CACHE_SIZE,
+        ttl: float = LLM_CACHE_TTL,
+        semantic: bool = LLM_SEMANTIC_CACHE_ENABLED,
+        max_distance: float = LLM_SEMANTIC_MAX_DISTANCE,
+        semantic_max_items: int = LLM_SEMANTIC_CACHE_SIZE,
+    ):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.semantic = semantic
+        self.max_distance = max_distance
+        self.semantic_max_items = semantic_max_items
+        self._entries = OrderedDict()   # exact key -> (expires_at, answer, compute_seconds)
+        self._semantic = OrderedDict()  # (sources key, query) -> (expires_at, unit vector, answer, compute_seconds)
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.saved_seconds = 0.0
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, answer, compute_seconds = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.expired += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self.saved_seconds += compute_seconds
+        return answer
+
+    def get_similar(self, group: str, embedding):
+        """Best cached answer in `group` whose query is close enough to `embedding`, or None."""
+        if not self.semantic or embedding is None:
+            return None
+        query_vec = _unit(embedding)
+        if query_vec is None:
+            return None
+        now = time.monotonic()
+        best_key, best_distance = None, self.max_distance
+        for entry_key, (expires_at, vec, _, _) in list(self._semantic.items()):
+            if expires_at < now:
+                del self._semantic[entry_key]
+                self.expired += 1
+                continue
+            if entry_key[0] != group or vec.shape != query_vec.shape:
+                continue
+            distance = 1.0 - float(np.dot(vec, query_vec))
+            if distance <= best_distance:
+                best_key, best_distance = entry_key, distance
+        if best_key is None:
+            return None
+        self._semantic.move_to_end(best_key)
+        _, _, answer, compute_seconds = self._semantic[best_key]
+        self.semantic_hits += 1
+        self.saved_seconds += compute_seconds
+        return answer
+
+    def record_miss(self):
+        self.misses += 1
+
+    def put(self, key: str, answer: str, compute_seconds: float, group: str = None, query: str = None, embedding=None):
+        expires_at = time.monotonic() + self.ttl
+        self._entries[key] = (expires_at, answer, compute_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_items:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+        if not self.semantic or group is None or embedding is None:
+            return
+        vec = _unit(embedding)
+        if vec is None:
+            return
+        self._semantic[(group, query)] = (expires_at, vec, answer, compute_seconds)
+        self._semantic.move_to_end((group, query))
+        while len(self._semantic) > self.semantic_max_items:
+            self._semantic.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._semantic.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.semantic_hits + self.misses
+        return {
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "items": len(self._entries),
+            "semantic_items": len(self._semantic),
+            "semantic_enabled": self.semantic,
+            "saved_seconds": round(self.saved_seconds, 3),
+        }
+
+
+def _unit(embedding):
+    vec = np.asarray(embedding, dtype=np.float32)
+    norm = float(np.linalg.norm(vec))
+    if not norm:
+        return None
+    return vec / norm
+
+
+_cache = None
+
+
+def get_llm_cache():
+    """Returns the process-wide cache, or None when caching is disabled."""
+    global _cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = LLMResponseCache()
+    return _cache
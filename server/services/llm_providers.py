@@ -0,0 +1,436 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+
+from openai import AsyncOpenAI
+from groq import AsyncGroq
+
+from services.http_clients import get_gemini_client, get_llm_client
+from services.metrics import span, count
+
+# Registry of LLM backends used by llmEngine nodes.
+# Each provider declares the model prefixes it serves, how many calls it may
+# have in flight, a timeout (including time spent waiting for a slot; for
+# streamed answers it bounds the wait for the first token and for each
+# following one, not the whole answer) and a fallback chain of models tried when it fails or times out. Optionally a
+# hedged request is sent to the first fallback when the primary hasn't
+# answered within its recent p95 latency; the first answer wins.
+#
+# Per provider (NAME = OPENAI, PERPLEXITY, GROQ, GEMINI):
+#   LLM_<NAME>_MAX_CONCURRENCY, LLM_<NAME>_TIMEOUT (seconds),
+#   LLM_<NAME>_FALLBACKS (comma separated model names, empty by default)
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY")
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+# Successful calls needed before a provider's p95 is trusted as the hedge delay
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Never hedge sooner than this, however fast the provider usually is
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+# Recent latencies kept per provider
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+
+DEFAULT_PROVIDER = "gemini"
+
+
+class ProviderError(Exception):
+    """A provider call failed; the message is shown to the user if no fallback succeeds."""
+
+
+def _env_int(name: str, key: str, default: int) -> int:
+    return int(os.getenv(f"LLM_{name.upper()}_{key}", str(default)))
+
+
+def _env_float(name: str, key: str, default: float) -> float:
+    return float(os.getenv(f"LLM_{name.upper()}_{key}", str(default)))
+
+
+def _env_models(name: str, key: str) -> tuple:
+    raw = os.getenv(f"LLM_{name.upper()}_{key}", "")
+    return tuple(model.strip() for model in raw.split(",") if model.strip())
+
+
+class LLMProvider:
+    def __init__(self, name: str, label: str, api_key: str, prefixes: tuple, call,
+                 max_concurrency: int, timeout: float, fallbacks: tuple = ()):
+        self.name = name
+        self.label = label
+        self.api_key = api_key
+        self.prefixes = prefixes
+        self._call = call
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.fallbacks = fallbacks
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._latencies = deque(maxlen=LLM_LATENCY_WINDOW)
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def available(self) -> bool:
+        return bool(self.api_key)
+
+    def serves(self, model: str) -> bool:
+        return model.startswith(self.prefixes)
+
+    def p95(self):
+        """Recent p95 latency in seconds, or None until enough calls have completed."""
+        if len(self._latencies) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    async def call(self, model: str, system_prompt: str, kb_context: str, query: str, on_token=None) -> str:
+        """One bounded, timed call. Raises on failure or timeout."""
+        self.calls += 1
+        try:
+            if on_token is not None:
+                return await self._streamed(model, system_prompt, kb_context, query, on_token)
+            return await asyncio.wait_for(self._bounded(model, system_prompt, kb_context, query, None), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        except Exception:
+            self.failures += 1
+            raise
+
+    async def _streamed(self, model, system_prompt, kb_context, query, on_token):
+        """Times out when no token has arrived for `timeout` seconds, so long answers aren't cut off."""
+        last_token = time.monotonic()
+
+        async def forward(text: str):
+            nonlocal last_token
+            last_token = time.monotonic()
+            await on_token(text)
+
+        task = asyncio.ensure_future(self._bounded(model, system_prompt, kb_context, query, forward))
+        try:
+            while True:
+                remaining = last_token + self.timeout - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                done, _ = await asyncio.wait({task}, timeout=remaining)
+                if done:
+                    return task.result()
+        finally:
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+    async def _bounded(self, model, system_prompt, kb_context, query, on_token):
+        started = time.perf_counter()
+        with span("llm", {"model": model}, provider=self.name) as s:
+            async with self._semaphore:
+                s.set(queued_ms=round((time.perf_counter() - started) * 1000, 2))
+                self.in_flight += 1
+                try:
+                    answer = await self._call(model, system_prompt, kb_context, query, on_token)
+                finally:
+                    self.in_flight -= 1
+        self._latencies.append(time.perf_counter() - started)
+        return answer
+
+    def stats(self) -> dict:
+        ordered = sorted(self._latencies)
+        return {
+            "configured": self.available(),
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "timeout": self.timeout,
+            "fallbacks": list(self.fallbacks),
+            "calls": self.calls,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "p50_ms": round(ordered[len(ordered) // 2] * 1000, 1) if ordered else None,
+            "p95_ms": round(self.p95() * 1000, 1) if self.p95() is not None else None,
+        }
+
+
+# --- Provider calls ---
+
+# Provider SDK clients share the pooled LLM http client. They are rebuilt
+# whenever the pool is recreated (e.g. after a shutdown/startup cycle).
+_provider_clients = {}
+
+def get_provider_client(name: str):
+    http_client = get_llm_client()
+    cached = _provider_clients.get(name)
+    if cached and cached[0] is http_client:
+        return cached[1]
+
+    if name == "openai":
+        client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http_client)
+    elif name == "perplexity":
+        client = AsyncOpenAI(api_key=PERPLEXITY_API_KEY, base_url="https://api.perplexity.ai", http_client=http_client)
+    elif name == "groq":
+        client = AsyncGroq(api_key=GROQ_API_KEY, http_client=http_client)
+    else:
+        raise ValueError(f"Unknown provider: {name}")
+
+    _provider_clients[name] = (http_client, client)
+    return client
+
+
+def build_messages(system_prompt: str, kb_context: str, query: str) -> list:
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"Context: {kb_context}\n\nQuestion: {query}"}
+    ]
+
+
+def build_prompt(system_prompt: str, kb_context: str, query: str) -> str:
+    prompt = f"System: {system_prompt}\n"
+    if kb_context:
+        prompt += f"Context: {kb_context}\n"
+    prompt += f"User: {query}"
+    return prompt
+
+
+async def generate_content_rest(prompt: str, model: str = "gemini-2.0-flash", on_token=None):
+    """Calls Gemini generateContent; with `on_token`, streams via streamGenerateContent (SSE) instead."""
+    if not GEMINI_API_KEY:
+        return "Error: No API Key configured."
+    
+    method = "streamGenerateContent?alt=sse&" if on_token else "generateContent?"
+    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:{method}key={GEMINI_API_KEY}"
+    data = {
+        "contents": [{
+            "parts": [{"text": prompt}]
+        }]
+    }
+    
+
+    client = get_gemini_client()
+    for attempt in range(5):
+        try:
+            if on_token:
+                with span("gemini_request", {"attempt": attempt + 1}, stream=True) as s:
+                    async with client.stream("POST", url, json=data, timeout=30.0) as resp:
+                        s.set(status=resp.status_code)
+                        if resp.status_code == 200:
+                            return await _read_gemini_stream(resp, on_token)
+                        await resp.aread()
+            else:
+                with span("gemini_request", {"attempt": attempt + 1}, stream=False) as s:
+                    resp = await client.post(url, json=data, timeout=30.0)
+                    s.set(status=resp.status_code)
+                if resp.status_code == 200:
+                    result = resp.json()
+                    try:
+                        text = result['candidates'][0]['content']['parts'][0]['text']
+                        return text
+                    except (KeyError, IndexError):
+                        logging.error(f"Unexpected Format: {result}")
+                        return "Error: Unexpected API response format."
+
+            if resp.status_code == 429:
+                wait_time = min(60, 2 * (2 ** attempt))
+                print(f"Gemini Chat 429. Retrying in {wait_time}s...")
+                count("upstream_retries_total", upstream="gemini_llm", reason="429")
+                with span("rate_limit_wait", upstream="gemini_llm"):
+                    await asyncio.sleep(wait_time)
+                continue
+            else:
+                 return f"Error ({resp.status_code}): {resp.text}"
+        except Exception as e:
+            logging.error(f"REST Gen Error: {e}", exc_info=True)
+            if attempt == 4: return f"Error calling API after retries: {str(e)}"
+    return "Error: Max retries exceeded."
+
+async def _read_gemini_stream(resp, on_token) -> str:
+    """Forwards the text parts of a streamGenerateContent SSE response and returns the full text."""
+    parts = []
+    try:
+        async for line in resp.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            payload = json.loads(line[5:].strip())
+            for candidate in (payload.get("candidates") or [])[:1]:
+                for part in (candidate.get("content") or {}).get("parts") or []:
+                    text = part.get("text")
+                    if text:
+                        parts.append(text)
+                        await on_token(text)
+    except Exception as e:
+        # Tokens already sent can't be retried without duplicating them
+        if not parts:
+            raise
+        logging.error(f"Gemini Stream Interrupted: {e}", exc_info=True)
+    return "".join(parts)
+
+async def _chat_completion(provider: str, model_name: str, messages: list, on_token=None) -> str:
+    """OpenAI-compatible chat completion (OpenAI, Perplexity, Groq), streamed when `on_token` is set."""
+    client = get_provider_client(provider)
+    if on_token is None:
+        response = await client.chat.completions.create(model=model_name, messages=messages)
+        return response.choices[0].message.content
+
+    stream = await client.chat.completions.create(model=model_name, messages=messages, stream=True)
+    parts = []
+    async for chunk in stream:
+        text = chunk.choices[0].delta.content if chunk.choices else None
+        if text:
+            parts.append(text)
+            await on_token(text)
+    return "".join(parts)
+
+
+def _chat_call(name: str):
+    async def call(model, system_prompt, kb_context, query, on_token):
+        return await _chat_completion(name, model, build_messages(system_prompt, kb_context, query), on_token)
+    return call
+
+
+async def _gemini_call(model, system_prompt, kb_context, query, on_token):
+    answer = await generate_content_rest(build_prompt(system_prompt, kb_context, query), model, on_token)
+    # generate_content_rest reports failures as text; turn them back into errors so fallbacks apply
+    if answer.startswith("Error"):
+        raise ProviderError(answer)
+    return answer
+
+
+# --- Registry ---
+
+PROVIDERS = {}
+
+
+def register_provider(provider: LLMProvider):
+    PROVIDERS[provider.name] = provider
+    return provider
+
+
+def _declare(name: str, label: str, api_key: str, prefixes: tuple, call, max_concurrency: int, timeout: float):
+    return register_provider(LLMProvider(
+        name=name,
+        label=label,
+        api_key=api_key,
+        prefixes=prefixes,
+        call=call,
+        max_concurrency=_env_int(name, "MAX_CONCURRENCY", max_concurrency),
+        timeout=_env_float(name, "TIMEOUT", timeout),
+        fallbacks=_env_models(name, "FALLBACKS"),
+    ))
+
+
+_declare("openai", "OpenAI", OPENAI_API_KEY, ("gpt",), _chat_call("openai"), 8, 60)
+_declare("perplexity", "Perplexity", PERPLEXITY_API_KEY, ("perplexity",), _chat_call("perplexity"), 4, 60)
+_declare("groq", "Groq", GROQ_API_KEY, ("llama", "mixtral"), _chat_call("groq"), 4, 30)
+# Catch-all; its timeout leaves room for generate_content_rest's own 429 backoff
+_declare("gemini", "Gemini", GEMINI_API_KEY, ("gemini",), _gemini_call, 8, 120)
+
+
+def provider_for(model: str) -> LLMProvider:
+    for provider in PROVIDERS.values():
+        if provider.serves(model):
+            return provider
+    return PROVIDERS[DEFAULT_PROVIDER]
+
+
+def _describe_error(e: Exception) -> str:
+    if isinstance(e, asyncio.TimeoutError):
+        return "timed out"
+    return str(e)
+
+
+async def _first_success(tasks: dict):
+    """Returns (answer, winning task) from the first task that succeeds; raises the last error if all fail."""
+    pending = set(tasks)
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result(), task
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _hedged_call(primary: LLMProvider, model: str, hedge: tuple, delay: float, args: tuple, called: set) -> str:
+    """Calls `primary`; if it hasn't answered after `delay` seconds, races it against the hedge target.
+
+    Adds the hedge target to `called` once it has been called.
+    """
+    first = asyncio.ensure_future(primary.call(model, *args))
+    tasks = [first]
+    try:
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+
+        hedge_provider, hedge_model = hedge
+        called.add(hedge)
+        primary.hedges += 1
+        count("llm_hedges_total", provider=primary.name)
+        second = asyncio.ensure_future(hedge_provider.call(hedge_model, *args))
+        tasks.append(second)
+        answer, winner = await _first_success({first: primary, second: hedge_provider})
+        if winner is second:
+            primary.hedge_wins += 1
+        return answer
+    finally:
+        # Also runs when the caller is cancelled mid-wait: no call outlives it
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def complete(model: str, system_prompt: str, kb_context: str, query: str, on_token=None) -> str:
+    """Answers with `model`, falling back along its provider's chain.
+
+    Failures are returned as "Error..." text, as the llmEngine node always has.
+    """
+    primary = provider_for(model)
+    targets = [(primary, model)] + [(provider_for(m), m) for m in primary.fallbacks]
+    targets = [(provider, m) for provider, m in targets if provider.available()]
+    if not targets:
+        return f"Error: {primary.label} API Key missing."
+
+    emitted = False
+    if on_token is not None:
+        async def forward(text: str):
+            nonlocal emitted
+            emitted = True
+            await on_token(text)
+    else:
+        forward = None
+
+    errors = []
+    called = set()  # hedge targets that already got (and failed) this request
+    for i, (provider, target_model) in enumerate(targets):
+        if (provider, target_model) in called:
+            continue
+        args = (system_prompt, kb_context, query, forward)
+        # Streamed tokens can't be taken back, so only non-streaming calls are hedged
+        delay = provider.p95() if LLM_HEDGE_ENABLED and forward is None and i + 1 < len(targets) else None
+        try:
+            if delay is not None:
+                return await _hedged_call(provider, target_model, targets[i + 1], max(delay, LLM_HEDGE_MIN_DELAY), args, called)
+            return await provider.call(target_model, *args)
+        except Exception as e:
+            logging.error(f"{provider.label} Error ({target_model}): {_describe_error(e)}", exc_info=not isinstance(e, (ProviderError, asyncio.TimeoutError)))
+            errors.append(_describe_error(e) if target_model == model else f"{target_model}: {_describe_error(e)}")
+            count("llm_failures_total", provider=provider.name)
+            if emitted:
+                # Part of this answer was already streamed; a fallback would repeat it
+                break
+
+    return f"Error ({primary.label}): " + "; ".join(errors)
+
+
+def provider_stats() -> dict:
+    return {name: provider.stats() for name, provider in PROVIDERS.items()}
@@ -0,0 +1,372 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+
+import numpy as np
+
+from services.embeddings import EMBEDDING_DIM
+from services.vector_backend import VectorStore, empty_result, matches_where
+from services.partitioned_store import PartitionedVectorStore, partition_slug
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", os.path.join(SERVER_DIR, ".cache", "local_index"))
+INITIAL_CAPACITY = 1024
+
+
+def _value_key(value):
+    # Metadata values are normally scalars; anything unhashable is indexed by its JSON form
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return ("__json__", json.dumps(value, sort_keys=True, default=str))
+
+
+class _MetadataColumn:
+    """One metadata key of every row, factorised into integer codes.
+
+    A filter on the key is evaluated once per distinct value and then
+    broadcast to all rows with a single array lookup.
+    """
+
+    def __init__(self, key: str, metadatas: list, capacity: int):
+        self.key = key
+        self.values = []
+        self._codes_by_value = {}
+        self.codes = np.zeros(capacity, dtype=np.int32)
+        for row, meta in enumerate(metadatas):
+            self.set(row, meta)
+
+    def set(self, row: int, meta: dict):
+        value = (meta or {}).get(self.key)
+        value_key = _value_key(value)
+        code = self._codes_by_value.get(value_key)
+        if code is None:
+            code = self._codes_by_value[value_key] = len(self.values)
+            self.values.append(value)
+        self.codes[row] = code
+
+    def grow(self, capacity: int):
+        codes = np.zeros(capacity, dtype=np.int32)
+        codes[:self.codes.shape[0]] = self.codes
+        self.codes = codes
+
+    def mask(self, condition, count: int) -> np.ndarray:
+        where = {self.key: condition}
+        lookup = np.fromiter(
+            (matches_where({self.key: value}, where) for value in self.values), dtype=bool, count=len(self.values)
+        )
+        return lookup[self.codes[:count]]
+
+
+class LocalVectorIndex(VectorStore):
+    """Exact in-process cosine search over a memory-mapped float32 matrix.
+
+    Rows are L2-normalised on insert, so a query is one matrix-vector product
+    followed by an argpartition top-k. Live rows are kept contiguous
+    (deletes swap the last row into the hole). Vectors live in
+    `vectors.f32`; ids, documents and metadata live in a SQLite sidecar
+    (`meta.sqlite3`) keyed by row, where each write only touches the rows it
+    changed. Disk writes run in a worker thread, off the event loop.
+    """
+
+    name = "local"
+
+    def __init__(self, path: str = LOCAL_INDEX_DIR, dim: int = EMBEDDING_DIM):
+        self.path = path
+        self.dim = dim
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self._db_path = os.path.join(path, "meta.sqlite3")
+        self._matrix = None
+        self._capacity = 0
+        self._ids = []
+        self._documents = []
+        self._metadatas = []
+        self._rows = {}
+        self._columns = {}  # metadata key -> _MetadataColumn, built on first filter by that key
+        self._db = None
+        self._persist_lock = asyncio.Lock()
+        self._load()
+
+    # --- persistence -------------------------------------------------------
+
+    def _open_db(self):
+        self._db = sqlite3.connect(self._db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS rows (row INTEGER PRIMARY KEY, id TEXT NOT NULL, document TEXT, metadata TEXT)"
+        )
+        self._db.commit()
+
+    def _load(self):
+        os.makedirs(self.path, exist_ok=True)
+        self._open_db()
+        info = dict(self._db.execute("SELECT key, value FROM info").fetchall())
+        if info and os.path.exists(self._vectors_path):
+            try:
+                self.dim = int(info["dim"])
+                self._capacity = int(info["capacity"])
+                for id_, document, metadata in self._db.execute("SELECT id, document, metadata FROM rows ORDER BY row"):
+                    self._ids.append(id_)
+                    self._documents.append(document)
+                    self._metadatas.append(json.loads(metadata) if metadata is not None else None)
+                self._rows = {id_: row for row, id_ in enumerate(self._ids)}
+                self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(self._capacity, self.dim))
+                return
+            except Exception as e:
+                print(f"Local index at {self.path} is unreadable, starting empty: {e}")
+                logging.error(f"Local Index Load Error: {e}", exc_info=True)
+                self._ids, self._documents, self._metadatas, self._rows = [], [], [], {}
+
+        self._capacity = INITIAL_CAPACITY
+        with open(self._vectors_path, "wb") as f:
+            f.truncate(self._capacity * self.dim * 4)
+        self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(self._capacity, self.dim))
+        self._write_rows(self._snapshot(range(0)), 0)
+
+    def _snapshot(self, rows) -> dict:
+        return {
+            "capacity": self._capacity,
+            "rows": [
+                (row, self._ids[row], self._documents[row], json.dumps(self._metadatas[row]) if self._metadatas[row] is not None else None)
+                for row in rows
+            ],
+        }
+
+    def _write_rows(self, snapshot: dict, count: int):
+        """Blocking: flushes vectors and writes the changed rows (runs in a worker thread)."""
+        self._matrix.flush()
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)",
+                [("dim", str(self.dim)), ("capacity", str(snapshot["capacity"]))],
+            )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO rows (row, id, document, metadata) VALUES (?, ?, ?, ?)", snapshot["rows"]
+            )
+            self._db.execute("DELETE FROM rows WHERE row >= ?", (count,))
+
+    async def _persist(self, rows):
+        """Persists the given rows (and the row count) once per write batch."""
+        async with self._persist_lock:
+            # Snapshot under the lock so later batches never get overwritten by older values
+            count = len(self._ids)
+            snapshot = self._snapshot(sorted(r for r in set(rows) if r < count))
+            await asyncio.to_thread(self._write_rows, snapshot, count)
+
+    async def _ensure_capacity(self, extra: int):
+        """Makes room for `extra` more rows.
+
+        Runs under the persist lock, so a flush in a worker thread never sees
+        the matrix while it is being re-mapped.
+        """
+        async with self._persist_lock:
+            rows = len(self._ids) + extra
+            if rows <= self._capacity:
+                return
+            new_capacity = max(rows, self._capacity * 2)
+            self._matrix.flush()
+            self._matrix = None
+            # Growing the file keeps existing rows in place and zero-fills the rest
+            with open(self._vectors_path, "r+b") as f:
+                f.truncate(new_capacity * self.dim * 4)
+            self._capacity = new_capacity
+            self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(self._capacity, self.dim))
+            for column in self._columns.values():
+                column.grow(new_capacity)
+
+    # --- helpers -----------------------------------------------------------
+
+    def _normalize(self, embeddings) -> np.ndarray:
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match index dimension {self.dim}")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _set_metadata(self, row: int, meta: dict):
+        self._metadatas[row] = meta
+        for column in self._columns.values():
+            column.set(row, meta)
+
+    def _column(self, key: str) -> _MetadataColumn:
+        column = self._columns.get(key)
+        if column is None:
+            column = self._columns[key] = _MetadataColumn(key, self._metadatas, self._capacity)
+        return column
+
+    def _where_mask(self, where: dict, count: int) -> np.ndarray:
+        """Vectorised matches_where over the first `count` rows."""
+        mask = np.ones(count, dtype=bool)
+        for key, condition in where.items():
+            if key == "$and":
+                for clause in condition:
+                    mask &= self._where_mask(clause, count)
+            elif key == "$or":
+                any_mask = np.zeros(count, dtype=bool)
+                for clause in condition:
+                    any_mask |= self._where_mask(clause, count)
+                mask &= any_mask
+            else:
+                mask &= self._column(key).mask(condition, count)
+        return mask
+
+    def _select_rows(self, ids: list = None, where: dict = None) -> list:
+        if ids is not None:
+            rows = [self._rows[i] for i in dict.fromkeys(ids) if i in self._rows]
+            if where:
+                mask = self._where_mask(where, len(self._ids))
+                rows = [r for r in rows if mask[r]]
+            return rows
+        if where:
+            return self._where_mask(where, len(self._ids)).nonzero()[0].tolist()
+        return list(range(len(self._ids)))
+
+    async def _write(self, ids: list, embeddings: list, documents: list, metadatas: list, overwrite: bool):
+        vectors = self._normalize(embeddings)
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [None] * len(ids)
+        await self._ensure_capacity(len(ids))
+
+        changed = []
+        for id_, vec, doc, meta in zip(ids, vectors, documents, metadatas):
+            row = self._rows.get(id_)
+            if row is None:
+                row = len(self._ids)
+                self._rows[id_] = row
+                self._ids.append(id_)
+                self._documents.append(doc)
+                self._metadatas.append(None)
+                self._set_metadata(row, meta)
+            elif not overwrite:
+                # Same as Chroma's add: existing ids are left untouched
+                continue
+            else:
+                self._documents[row] = doc
+                self._set_metadata(row, meta)
+            self._matrix[row] = vec
+            changed.append(row)
+
+        await self._persist(changed)
+
+    # --- VectorStore -------------------------------------------------------
+
+    async def add(self, ids: list, embeddings: list, documents: list, metadatas: list):
+        await self._write(ids, embeddings, documents, metadatas, overwrite=False)
+
+    async def upsert(self, ids: list, embeddings: list, documents: list, metadatas: list):
+        await self._write(ids, embeddings, documents, metadatas, overwrite=True)
+
+    async def update_metadata(self, ids: list, metadatas: list):
+        changed = []
+        for id_, meta in zip(ids, metadatas):
+            row = self._rows.get(id_)
+            if row is not None:
+                self._set_metadata(row, meta)
+                changed.append(row)
+        if changed:
+            await self._persist(changed)
+
+    async def query(self, embedding: list, n_results: int = 3, where: dict = None) -> dict:
+        count = len(self._ids)
+        if count == 0 or n_results <= 0:
+            return empty_result()
+
+        query = self._normalize(embedding)[0]
+        if where:
+            candidates = self._where_mask(where, count).nonzero()[0]
+            if candidates.size == 0:
+                return empty_result()
+            scores = self._matrix[candidates] @ query
+        else:
+            candidates = None
+            scores = self._matrix[:count] @ query
+
+        k = min(n_results, scores.shape[0])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        rows = candidates[top] if candidates is not None else top
+
+        return {
+            "ids": [self._ids[r] for r in rows],
+            "documents": [self._documents[r] for r in rows],
+            "metadatas": [self._metadatas[r] for r in rows],
+            "distances": [float(1.0 - s) for s in scores[top]],
+        }
+
+    async def get(self, ids: list = None, where: dict = None, include_documents: bool = True) -> dict:
+        rows = self._select_rows(ids, where)
+        return {
+            "ids": [self._ids[r] for r in rows],
+            "documents": [self._documents[r] if include_documents else None for r in rows],
+            "metadatas": [self._metadatas[r] for r in rows],
+        }
+
+    async def delete(self, ids: list = None, where: dict = None):
+        if ids is None and not where:
+            return
+        rows = self._select_rows(ids, where)
+        if not rows:
+            return
+
+        # Delete from the back so swapped-in rows are never ones still pending deletion
+        moved = set()
+        for row in sorted(rows, reverse=True):
+            last = len(self._ids) - 1
+            del self._rows[self._ids[row]]
+            if row != last:
+                self._matrix[row] = self._matrix[last]
+                self._ids[row] = self._ids[last]
+                self._documents[row] = self._documents[last]
+                self._set_metadata(row, self._metadatas[last])
+                self._rows[self._ids[row]] = row
+                moved.add(row)
+            self._ids.pop()
+            self._documents.pop()
+            self._metadatas.pop()
+
+        # Rows past the new end are dropped by the count; only moved rows are rewritten
+        await self._persist(moved)
+
+    async def count(self) -> int:
+        return len(self._ids)
+
+    async def close(self):
+        if self._matrix is not None:
+            async with self._persist_lock:
+                await asyncio.to_thread(self._matrix.flush)
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def open_partitioned_local_index(root: str = LOCAL_INDEX_DIR, dim: int = EMBEDDING_DIM) -> PartitionedVectorStore:
+    """Source-sharded local index: one LocalVectorIndex directory per source document."""
+    os.makedirs(root, exist_ok=True)
+    registry_path = os.path.join(root, "partitions.json")
+    registry = {}
+    if os.path.exists(registry_path):
+        with open(registry_path, "r", encoding="utf-8") as f:
+            registry = json.load(f)
+
+    def make_partition(source: str) -> LocalVectorIndex:
+        slug = partition_slug(source)
+        if registry.get(source) != slug:
+            registry[source] = slug
+            tmp_path = registry_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(registry, f)
+            os.replace(tmp_path, registry_path)
+        return LocalVectorIndex(path=os.path.join(root, "partitions", slug), dim=dim)
+
+    async def list_sources() -> list:
+        return list(registry.keys())
+
+    return PartitionedVectorStore(make_partition, list_sources, name="local")
@@ -0,0 +1,151 @@
+import itertools
+import os
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+# Lightweight instrumentation: duration spans and counters.
+# Every span feeds an in-process histogram (rendered for Prometheus by
+# render_prometheus) and, when a trace is active (collect_spans, used per
+# workflow run), is also appended to that trace so a run can report where its
+# time went. Label values must be low cardinality (span kind, node type,
+# provider...); per-call details go in span attributes, which only appear in
+# traces.
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+METRICS_PREFIX = os.getenv("METRICS_PREFIX", "kb")
+
+# Seconds; covers cache hits (ms) up to slow LLM answers and 429 backoffs
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_trace: ContextVar = ContextVar("metrics_trace", default=None)           # (spans, started_at)
+_current_span: ContextVar = ContextVar("metrics_current_span", default=None)
+
+_histograms = {}  # (name, labels) -> [bucket counts..., +Inf count], sum
+_counters = {}    # (name, labels) -> value
+_span_ids = itertools.count(1)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def observe(name: str, seconds: float, **labels):
+    """Adds one observation to a duration histogram."""
+    if not METRICS_ENABLED:
+        return
+    key = (name, _label_key(labels))
+    entry = _histograms.get(key)
+    if entry is None:
+        entry = _histograms[key] = [[0] * (len(DURATION_BUCKETS) + 1), 0.0]
+    entry[0][bisect_left(DURATION_BUCKETS, seconds)] += 1
+    entry[1] += seconds
+
+
+def count(name: str, amount: float = 1, **labels):
+    """Increments a counter."""
+    if not METRICS_ENABLED:
+        return
+    key = (name, _label_key(labels))
+    _counters[key] = _counters.get(key, 0) + amount
+
+
+class span:
+    """Times a block: `with span("embed", upstream="gemini") as s: ...; s.set(status=200)`.
+
+    Works around awaits. Exceptions are counted and re-raised.
+    """
+
+    __slots__ = ("name", "labels", "attrs", "started", "id", "parent", "_token")
+
+    def __init__(self, name: str, attrs: dict = None, **labels):
+        self.name = name
+        self.labels = labels
+        self.attrs = dict(attrs) if attrs else {}
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.id = next(_span_ids)
+        self.parent = _current_span.get()
+        self._token = _current_span.set(self.id)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.started
+        _current_span.reset(self._token)
+        observe("span_duration_seconds", duration, span=self.name, **self.labels)
+        if exc_type is not None:
+            count("span_errors_total", span=self.name, **self.labels)
+            self.attrs.setdefault("error", exc_type.__name__)
+
+        trace = _trace.get()
+        if trace is not None:
+            spans, trace_started = trace
+            spans.append({
+                "id": self.id,
+                "parent": self.parent,
+                "name": self.name,
+                **self.labels,
+                **self.attrs,
+                "start_ms": round((self.started - trace_started) * 1000, 2),
+                "duration_ms": round(duration * 1000, 2),
+            })
+        return False
+
+
+class collect_spans:
+    """`with collect_spans() as spans:` collects the spans of the block (and tasks it starts) into `spans`."""
+
+    __slots__ = ("spans", "_tokens")
+
+    def __enter__(self) -> list:
+        self.spans = []
+        self._tokens = (_trace.set((self.spans, time.perf_counter())), _current_span.set(None))
+        return self.spans
+
+    def __exit__(self, exc_type, exc, tb):
+        _trace.reset(self._tokens[0])
+        _current_span.reset(self._tokens[1])
+        return False
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for k, v in pairs
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def render_prometheus() -> str:
+    """Histograms and counters in the Prometheus text exposition format."""
+    lines = []
+    by_name = {}
+    for (name, labels), entry in _histograms.items():
+        by_name.setdefault(name, []).append((labels, entry))
+    for name, series in sorted(by_name.items()):
+        metric = f"{METRICS_PREFIX}_{name}"
+        lines.append(f"# TYPE {metric} histogram")
+        for labels, (buckets, total) in sorted(series):
+            cumulative = 0
+            for bound, bucket_count in zip(DURATION_BUCKETS + ("+Inf",), buckets):
+                cumulative += bucket_count
+                lines.append(f"{metric}_bucket{_format_labels(labels, (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {cumulative}")
+
+    by_name = {}
+    for (name, labels), value in _counters.items():
+        by_name.setdefault(name, []).append((labels, value))
+    for name, series in sorted(by_name.items()):
+        metric = f"{METRICS_PREFIX}_{name}"
+        lines.append(f"# TYPE {metric} counter")
+        for labels, value in sorted(series):
+            lines.append(f"{metric}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
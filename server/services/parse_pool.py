@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from services.document_processor import iter_pdf_pages, iter_page_chunks, FIXED
+
+# PDF parsing (PyMuPDF) is CPU-bound and synchronous. Running it on the event
+# loop stalls every other request on the worker, so extraction and chunking
+# run in a pool instead.
+#   process - separate processes, no GIL contention (default)
+#   thread  - threads, for platforms where subprocesses are unavailable
+PARSE_POOL_MODE = os.getenv("PARSE_POOL_MODE", "process").lower()
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Cap on parse jobs submitted at once; extra uploads wait their turn
+PARSE_MAX_CONCURRENT = int(os.getenv("PARSE_MAX_CONCURRENT", str(PARSE_WORKERS)))
+# Worker start method. Forking a process that already runs an event loop and
+# client threads can deadlock the child, so workers start fresh by default.
+PARSE_MP_START_METHOD = os.getenv("PARSE_MP_START_METHOD", "spawn")
+
+_executor = None
+_semaphore = None
+_recover_lock = None
+
+
+def parse_pdf_page_chunks(source, chunk_size: int = 1000, overlap: int = 100, chunker: str = FIXED, known: frozenset = frozenset()) -> list:
+    """Extracts a PDF and chunks each page on its own, skipping pages in `known`. Runs inside the pool.
+
+    Returns every page at once: the ingest plan is built over the whole
+    document, so the chunk text of its changed pages is held in memory.
+    """
+    return list(iter_page_chunks(iter_pdf_pages(source), chunk_size, overlap, chunker, known))
+
+
+def _create_executor():
+    if PARSE_POOL_MODE == "process":
+        try:
+            return ProcessPoolExecutor(
+                max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context(PARSE_MP_START_METHOD)
+            )
+        except Exception as e:
+            print(f"Process pool unavailable, parsing PDFs in threads instead: {e}")
+            logging.error(f"Parse Pool Error: {e}", exc_info=True)
+    return ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix="pdf-parse")
+
+
+def start_parse_pool():
+    """Creates the parse pool. Called from the app startup hook."""
+    global _executor, _semaphore, _recover_lock
+    if _executor is None:
+        _executor = _create_executor()
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(PARSE_MAX_CONCURRENT)
+    if _recover_lock is None:
+        _recover_lock = asyncio.Lock()
+
+
+def shutdown_parse_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def _replace_broken_pool(broken):
+    """Replaces the pool once, however many callers saw it break."""
+    global _executor
+    async with _recover_lock:
+        # Another caller may already have swapped in a fresh pool; leave that one alone
+        if _executor is broken:
+            logging.error("Parse pool broken, recreating it")
+            broken.shutdown(wait=False, cancel_futures=True)
+            _executor = _create_executor()
+
+
+async def run_in_parse_pool(fn, *args):
+    """Runs a picklable function in the parse pool without blocking the event loop."""
+    start_parse_pool()
+    loop = asyncio.get_running_loop()
+    async with _semaphore:
+        executor = _executor
+        try:
+            return await loop.run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. crashed on a malformed PDF); replace the pool and retry once
+            await _replace_broken_pool(executor)
+            return await loop.run_in_executor(_executor, fn, *args)
+
+
+async def parse_pdf_pages(source, chunk_size: int = 1000, overlap: int = 100, chunker: str = FIXED, known: frozenset = frozenset()) -> list:
+    """Returns [{"page", "page_hash", "chunks"}] for a PDF, parsed off the event loop."""
+    return await run_in_parse_pool(parse_pdf_page_chunks, source, chunk_size, overlap, chunker, frozenset(known))
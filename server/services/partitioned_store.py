@@ -0,0 +1,182 @@
+import asyncio
+import hashlib
+
+from services.vector_backend import VectorStore, empty_result
+
+PARTITION_KEY = "source"
+
+
+def partition_slug(source: str) -> str:
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+
+
+def sources_from_where(where: dict):
+    """Returns the sources a filter is restricted to, or None if it can match any source."""
+    if not where:
+        return None
+    for key, condition in where.items():
+        if key == PARTITION_KEY:
+            if isinstance(condition, dict):
+                if "$eq" in condition:
+                    return [condition["$eq"]]
+                if "$in" in condition:
+                    return list(condition["$in"])
+                return None
+            return [condition]
+        if key == "$and":
+            for clause in condition:
+                sources = sources_from_where(clause)
+                if sources is not None:
+                    return sources
+    return None
+
+
+def strip_source_filter(where: dict):
+    """Drops source clauses from a filter once partition routing has applied them."""
+    if not where:
+        return None
+    stripped = {}
+    for key, condition in where.items():
+        if key == PARTITION_KEY:
+            continue
+        if key == "$and":
+            clauses = [c for c in (strip_source_filter(c) for c in condition) if c]
+            if len(clauses) == 1:
+                stripped.update(clauses[0])
+            elif clauses:
+                stripped["$and"] = clauses
+            continue
+        stripped[key] = condition
+    return stripped or None
+
+
+class PartitionedVectorStore(VectorStore):
+    """Routes records to one child store per source document.
+
+    Queries scoped to sources (via a `source` filter) only touch those
+    partitions, so their cost scales with the size of the scoped documents
+    rather than the whole corpus. Unscoped queries fan out to every partition
+    and merge the per-partition top-k by distance.
+    """
+
+    def __init__(self, make_partition, list_sources, name: str):
+        self._make_partition = make_partition
+        self._list_sources = list_sources
+        self._partitions = {}
+        self._discovered = False
+        self.name = name
+
+    async def _partition(self, source: str) -> VectorStore:
+        store = self._partitions.get(source)
+        if store is None:
+            store = self._make_partition(source)
+            self._partitions[source] = store
+        return store
+
+    async def _all_sources(self) -> list:
+        if not self._discovered:
+            for source in await self._list_sources():
+                self._partitions.setdefault(source, None)
+            self._discovered = True
+        return list(self._partitions.keys())
+
+    async def _targets(self, where: dict):
+        """Returns ([(source, partition), ...] to visit, filter to apply inside each of them)."""
+        sources = sources_from_where(where)
+        if sources is None:
+            sources = await self._all_sources()
+        else:
+            # Scoped lookups never create empty partitions
+            known = set(await self._all_sources())
+            sources = [s for s in sources if s in known]
+            where = strip_source_filter(where)
+        return [(s, await self._partition(s)) for s in sources], where
+
+    def _group(self, ids: list, embeddings: list, documents: list, metadatas: list) -> dict:
+        groups = {}
+        for i, meta in enumerate(metadatas):
+            source = (meta or {}).get(PARTITION_KEY)
+            if source is None:
+                raise ValueError(f"Record {ids[i]} has no '{PARTITION_KEY}' metadata to partition on")
+            groups.setdefault(source, []).append(i)
+        return groups
+
+    async def _write(self, op: str, ids: list, embeddings: list, documents: list, metadatas: list):
+        documents = documents or [None] * len(ids)
+        for source, rows in self._group(ids, embeddings, documents, metadatas).items():
+            store = await self._partition(source)
+            await getattr(store, op)(
+                ids=[ids[i] for i in rows],
+                embeddings=[embeddings[i] for i in rows],
+                documents=[documents[i] for i in rows],
+                metadatas=[metadatas[i] for i in rows],
+            )
+
+    async def add(self, ids: list, embeddings: list, documents: list, metadatas: list):
+        await self._write("add", ids, embeddings, documents, metadatas)
+
+    async def upsert(self, ids: list, embeddings: list, documents: list, metadatas: list):
+        await self._write("upsert", ids, embeddings, documents, metadatas)
+
+    async def update_metadata(self, ids: list, metadatas: list):
+        for source, rows in self._group(ids, None, None, metadatas).items():
+            store = await self._partition(source)
+            await store.update_metadata(ids=[ids[i] for i in rows], metadatas=[metadatas[i] for i in rows])
+
+    async def query(self, embedding: list, n_results: int = 3, where: dict = None) -> dict:
+        targets, where = await self._targets(where)
+        if not targets:
+            return empty_result()
+
+        results = await asyncio.gather(*[t.query(embedding, n_results=n_results, where=where) for _, t in targets])
+        if len(results) == 1:
+            return results[0]
+
+        hits = []
+        for result in results:
+            hits.extend(zip(result["distances"], result["ids"], result["documents"], result["metadatas"]))
+        hits.sort(key=lambda hit: hit[0])
+        hits = hits[:n_results]
+
+        return {
+            "ids": [h[1] for h in hits],
+            "documents": [h[2] for h in hits],
+            "metadatas": [h[3] for h in hits],
+            "distances": [h[0] for h in hits],
+        }
+
+    async def get(self, ids: list = None, where: dict = None, include_documents: bool = True) -> dict:
+        merged = empty_result(include_distances=False)
+        targets, where = await self._targets(where)
+        for _, store in targets:
+            result = await store.get(ids=ids, where=where, include_documents=include_documents)
+            for key in merged:
+                merged[key].extend(result[key])
+        return merged
+
+    async def delete(self, ids: list = None, where: dict = None):
+        if ids is None and not where:
+            return
+        scoped = sources_from_where(where) is not None
+        targets, inner_where = await self._targets(where)
+        for source, store in targets:
+            if scoped and ids is None and not inner_where:
+                # Deleting a whole source: clear its partition
+                await store.delete(where={PARTITION_KEY: source})
+            else:
+                await store.delete(ids=ids, where=inner_where)
+
+    async def count(self) -> int:
+        total = 0
+        targets, _ = await self._targets(None)
+        for _, store in targets:
+            total += await store.count()
+        return total
+
+    async def sources(self) -> list:
+        return await self._all_sources()
+
+    async def close(self):
+        for store in self._partitions.values():
+            if store is not None:
+                await store.close()
@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Async token bucket. `rate_per_minute` tokens refill continuously up to `capacity`."""
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available (0 if they are available now)."""
+        self._refill()
+        # Requests larger than the bucket are let through once it is full
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """Paces calls against a requests/min and a tokens/min budget.
+
+    Callers wait in FIFO order before sending instead of discovering the
+    limit through 429 responses. A limit of 0 disables that dimension.
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self._lock = asyncio.Lock()
+        self._paused_until = 0.0
+        self.waits = 0
+        self.waited_seconds = 0.0
+
+    async def acquire(self, tokens: float = 0):
+        async with self._lock:
+            while True:
+                delay = max(0.0, self._paused_until - time.monotonic())
+                if self.requests:
+                    delay = max(delay, self.requests.wait_time(1))
+                if self.tokens and tokens:
+                    delay = max(delay, self.tokens.wait_time(tokens))
+                if delay <= 0:
+                    break
+                self.waits += 1
+                self.waited_seconds += delay
+                await asyncio.sleep(delay)
+
+            if self.requests:
+                self.requests.consume(1)
+            if self.tokens and tokens:
+                self.tokens.consume(tokens)
+
+    def pause(self, seconds: float):
+        """Holds back every caller for `seconds`, e.g. after the upstream returned a 429."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def stats(self) -> dict:
+        return {"waits": self.waits, "waited_seconds": round(self.waited_seconds, 3)}
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token is close enough for budgeting English text
+    return len(text) // 4 + 1
@@ -0,0 +1,107 @@
+import json
+import os
+import time
+from collections import OrderedDict
+
+# Bounded TTL/LRU cache of retrieval results.
+# Keys include a collection version counter that every ingest/delete bumps,
+# so a result computed before a write can never be served after it.
+
+RETRIEVAL_CACHE_ENABLED = os.getenv("RETRIEVAL_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "1000"))
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "300"))
+
+# Bumped on every write, whether or not caching is enabled. Keys of shared
+# in-flight work include it so nothing started before a write is handed to a
+# caller that arrives after it.
+_collection_version = 0
+
+
+class RetrievalCache:
+    def __init__(self, max_items: int = RETRIEVAL_CACHE_SIZE, ttl: float = RETRIEVAL_CACHE_TTL):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.version = 0
+        self._entries = OrderedDict()  # key -> (expires_at, hits, compute_seconds)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.saved_seconds = 0.0
+
+    def key(self, query: str, n_results: int, where: dict, mode: str) -> tuple:
+        where_key = json.dumps(where, sort_keys=True) if where else ""
+        return (self.version, mode, n_results, where_key, query)
+
+    def get(self, key: tuple):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, hits, compute_seconds = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.expired += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self.saved_seconds += compute_seconds
+        # Copies so callers can't mutate the cached hits
+        return [dict(hit) for hit in hits]
+
+    def put(self, key: tuple, hits: list, compute_seconds: float):
+        if key[0] != self.version:
+            # Computed against a collection that has since changed
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, [dict(hit) for hit in hits], compute_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_items:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def bump_version(self):
+        """Called after any write to the collection; drops every cached result."""
+        self.version += 1
+        self.invalidations += 1
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "version": self.version,
+            "items": len(self._entries),
+            "saved_seconds": round(self.saved_seconds, 3),
+        }
+
+
+_cache = None
+
+
+def collection_version() -> int:
+    return _collection_version
+
+
+def get_retrieval_cache():
+    """Returns the process-wide cache, or None when caching is disabled."""
+    global _cache
+    if not RETRIEVAL_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = RetrievalCache()
+    return _cache
+
+
+def invalidate_retrieval_cache():
+    global _collection_version
+    _collection_version += 1
+    cache = get_retrieval_cache()
+    if cache is not None:
+        cache.bump_version()
@@ -3,22 +3,12 @@ from sqlalchemy.future import select
 from models.stack import Stack
 import uuid
 import logging
-from services.vector_store import add_documents, query_documents
-from services.document_processor import chunk_text
+from services.ingestion import plan_text, store_plan, finish_source, source_lock
 
 async def seed_vectors():
     """Seeds the vector database with test data if it doesn't exist."""
     print("Checking vector store for seed data...")
     try:
-        # Check if test.pdf data exists
-        # query_documents returns a list of strings if found, or empty list
-        results = await query_documents(query_text="test", n_results=1, where={"source": "test.pdf"})
-        if results:
-            print("Vector store already seeded with test.pdf.")
-            return
-
-        print("Seeding vector store with test.pdf data...")
-        
         # Dummy content for test.pdf
         text = """
         PROJECT OVERVIEW:
@@ -36,12 +26,16 @@ async def seed_vectors():
         4. Integration: The system connects to external APIs like OpenAI, Google Gemini, and Groq to provide intelligence.
         """
         
-        chunks = chunk_text(text)
-        ids = [str(uuid.uuid4()) for _ in chunks]
-        metadatas = [{"source": "test.pdf"} for _ in chunks]
-        
-        await add_documents(documents=chunks, metadatas=metadatas, ids=ids)
-        print("Vector store seeded successfully.")
+        # Indexed like an uploaded one-page PDF: same page-anchored chunk ids,
+        # so an existing seed is skipped and a re-upload of test.pdf replaces it
+        async with source_lock("test.pdf"):
+            plan = await plan_text("test.pdf", [(1, text)])
+            stored = await store_plan(plan)
+            report = await finish_source(plan, stored["stored"], stored["failed_pages"], stored["failed_ids"])
+        if report["new"]:
+            print("Vector store seeded successfully.")
+        else:
+            print("Vector store already seeded with test.pdf.")
         
     except Exception as e:
         print(f"Failed to seed vector store: {e}")
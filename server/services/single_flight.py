@@ -0,0 +1,57 @@
+import asyncio
+import os
+
+# Single-flight de-duplication of identical in-flight work.
+# The first caller for a key starts the work; callers that arrive while it is
+# still running await the same task instead of repeating it. Nothing is kept
+# once the task finishes, so this never serves a result computed before the
+# caller arrived (unlike a cache). Callers must not mutate shared results.
+
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+class SingleFlight:
+    def __init__(self, enabled: bool = SINGLE_FLIGHT_ENABLED):
+        self.enabled = enabled
+        self._calls = {}  # key -> [task, waiting callers]
+        self.executions = 0
+        self.shared = 0
+
+    async def do(self, key, fn):
+        """Returns the result of `fn()`, sharing one execution among concurrent callers with the same key."""
+        if not self.enabled:
+            return await fn()
+
+        call = self._calls.get(key)
+        if call is None:
+            task = asyncio.ensure_future(fn())
+            call = self._calls[key] = [task, 0]
+            task.add_done_callback(lambda t, key=key: self._forget(key, t))
+            self.executions += 1
+        else:
+            self.shared += 1
+
+        call[1] += 1
+        try:
+            # Shielded so one caller going away doesn't cancel the others' result
+            return await asyncio.shield(call[0])
+        finally:
+            call[1] -= 1
+            if call[1] == 0 and not call[0].done():
+                # Every caller gave up (e.g. all clients disconnected): stop the work
+                self._forget(key, call[0])
+                call[0].cancel()
+
+    def _forget(self, key, task):
+        call = self._calls.get(key)
+        if call is not None and call[0] is task:
+            del self._calls[key]
+
+    def stats(self) -> dict:
+        calls = self.executions + self.shared
+        return {
+            "executions": self.executions,
+            "shared": self.shared,
+            "shared_rate": round(self.shared / calls, 4) if calls else 0.0,
+            "in_flight": len(self._calls),
+        }
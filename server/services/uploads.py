@@ -0,0 +1,140 @@
+import logging
+import os
+import tempfile
+import zipfile
+
+from fastapi import UploadFile
+
+# Uploads are streamed to a spool file on disk in fixed-size chunks instead of
+# being read into one bytes object, so receiving an upload doesn't buffer the
+# file in memory. PyMuPDF then opens the file by path.
+
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024)
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or tempfile.gettempdir()
+UPLOAD_READ_CHUNK = 1024 * 1024
+# Limits for /api/upload/bulk: total size and number of PDFs (files + ZIP members).
+# Every PDF, uploaded directly or inside a ZIP, is still capped at
+# MAX_UPLOAD_BYTES; a ZIP archive is only a container and may be as large as
+# the bulk limit. The bulk limit applies to the sum of the PDF bytes written to
+# disk, i.e. ZIP members count with their decompressed size.
+MAX_BULK_UPLOAD_BYTES = int(float(os.getenv("MAX_BULK_UPLOAD_MB", "1024")) * 1024 * 1024)
+BULK_MAX_FILES = int(os.getenv("BULK_MAX_FILES", "1000"))
+# Allowance for multipart boundaries/headers when checking Content-Length
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class TooManyFiles(Exception):
+    def __init__(self, max_files: int = BULK_MAX_FILES):
+        self.max_files = max_files
+        super().__init__(f"Bulk uploads are limited to {max_files} PDFs")
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.max_bytes = max_bytes
+        super().__init__(f"File exceeds the maximum upload size of {max_bytes // (1024 * 1024)} MB")
+
+
+class BulkUploadTooLarge(UploadTooLarge):
+    def __init__(self, max_bytes: int = MAX_BULK_UPLOAD_BYTES):
+        self.max_bytes = max_bytes
+        Exception.__init__(self, f"Upload exceeds the maximum total size of {max_bytes // (1024 * 1024)} MB")
+
+
+class UploadBudget:
+    """Running total of bytes spooled for one bulk upload."""
+
+    def __init__(self, max_bytes: int = MAX_BULK_UPLOAD_BYTES):
+        self.max_bytes = max_bytes
+        self.used = 0
+
+    def take(self, size: int):
+        self.used += size
+        if self.used > self.max_bytes:
+            raise BulkUploadTooLarge(self.max_bytes)
+
+
+def content_length_too_large(content_length, max_bytes: int = MAX_UPLOAD_BYTES) -> bool:
+    """True if a request's declared Content-Length can't fit within the upload limit."""
+    try:
+        return int(content_length) > max_bytes + MULTIPART_OVERHEAD
+    except (TypeError, ValueError):
+        return False
+
+
+async def spool_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES, suffix: str = ".pdf", directory: str = None, budget: UploadBudget = None) -> str:
+    """Streams an upload to a temp file and returns its path. The caller removes it.
+
+    Raises UploadTooLarge as soon as more than `max_bytes` have been read, or
+    BulkUploadTooLarge once `budget` (if given) is used up.
+    """
+    directory = directory or UPLOAD_SPOOL_DIR
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="upload-", suffix=suffix, dir=directory)
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(UPLOAD_READ_CHUNK)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(max_bytes)
+                if budget is not None:
+                    budget.take(len(chunk))
+                out.write(chunk)
+    except BaseException:
+        remove_spool_file(path)
+        raise
+    return path
+
+
+def remove_spool_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.error(f"Failed to remove spool file {path}: {e}")
+
+
+def extract_zip_pdfs(zip_path: str, max_files: int = BULK_MAX_FILES, max_bytes: int = MAX_UPLOAD_BYTES, directory: str = None, budget: UploadBudget = None) -> list:
+    """Extracts the PDFs in a ZIP archive to spool files. Blocking; run it off the event loop.
+
+    Returns [(member name, spool path)]. Non-PDF members are ignored. Sizes
+    are enforced on the bytes actually decompressed, not the sizes the archive
+    declares: `max_bytes` per member and `budget` across the whole upload.
+    Raises zipfile.BadZipFile, TooManyFiles, UploadTooLarge or
+    BulkUploadTooLarge; on error every file extracted so far is removed.
+    """
+    directory = directory or UPLOAD_SPOOL_DIR
+    os.makedirs(directory, exist_ok=True)
+    extracted = []
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            for info in archive.infolist():
+                name = info.filename
+                if info.is_dir() or not name.lower().endswith(".pdf") or name.startswith("__MACOSX/"):
+                    continue
+                if len(extracted) >= max_files:
+                    raise TooManyFiles(max_files)
+                fd, path = tempfile.mkstemp(prefix="upload-", suffix=".pdf", dir=directory)
+                extracted.append((name, path))
+                size = 0
+                with os.fdopen(fd, "wb") as out, archive.open(info) as member:
+                    while True:
+                        chunk = member.read(UPLOAD_READ_CHUNK)
+                        if not chunk:
+                            break
+                        size += len(chunk)
+                        if size > max_bytes:
+                            raise UploadTooLarge(max_bytes)
+                        if budget is not None:
+                            budget.take(len(chunk))
+                        out.write(chunk)
+    except BaseException:
+        for _, path in extracted:
+            remove_spool_file(path)
+        raise
+    return extracted
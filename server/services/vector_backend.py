@@ -0,0 +1,128 @@
+import os
+from abc import ABC, abstractmethod
+
+# Which VectorStore implementation backs the knowledge base.
+#   chroma - Chroma server over REST (default, see services/chroma_store.py)
+#   local  - in-process NumPy index memory-mapped from disk, one shard per
+#            source document (services/local_index.py)
+# Set CHROMA_PARTITION_BY_SOURCE=true to give Chroma one collection per source.
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+
+
+class VectorStore(ABC):
+    """Storage/search interface for embedded chunks.
+
+    Embedding happens in services/vector_store.py; backends only store vectors
+    and run nearest-neighbour search. `where` filters use Chroma's metadata
+    filter syntax ({"source": "a.pdf"}, {"page": {"$gte": 3}}, {"$and": [...]}).
+    Distances are cosine distances (0 = identical).
+    """
+
+    name = "base"
+
+    @abstractmethod
+    async def add(self, ids: list, embeddings: list, documents: list, metadatas: list):
+        ...
+
+    @abstractmethod
+    async def upsert(self, ids: list, embeddings: list, documents: list, metadatas: list):
+        ...
+
+    @abstractmethod
+    async def update_metadata(self, ids: list, metadatas: list):
+        """Replaces the metadata of existing records without touching their vectors."""
+
+    @abstractmethod
+    async def query(self, embedding: list, n_results: int = 3, where: dict = None) -> dict:
+        """Returns {"ids", "documents", "metadatas", "distances"} for the best matches, best first."""
+
+    @abstractmethod
+    async def get(self, ids: list = None, where: dict = None, include_documents: bool = True) -> dict:
+        """Returns {"ids", "documents", "metadatas"} for the matching records."""
+
+    @abstractmethod
+    async def delete(self, ids: list = None, where: dict = None):
+        ...
+
+    @abstractmethod
+    async def count(self) -> int:
+        ...
+
+    async def close(self):
+        pass
+
+
+def empty_result(include_distances: bool = True) -> dict:
+    result = {"ids": [], "documents": [], "metadatas": []}
+    if include_distances:
+        result["distances"] = []
+    return result
+
+
+def matches_where(metadata: dict, where: dict) -> bool:
+    """Evaluates a Chroma-style metadata filter against one metadata dict."""
+    if not where:
+        return True
+    metadata = metadata or {}
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, c) for c in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, c) for c in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for op, expected in condition.items():
+                if not _compare(value, op, expected):
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def _compare(value, op: str, expected) -> bool:
+    if op == "$eq":
+        return value == expected
+    if op == "$ne":
+        return value != expected
+    if op == "$in":
+        return value in expected
+    if op == "$nin":
+        return value not in expected
+    if value is None:
+        return False
+    if op == "$gt":
+        return value > expected
+    if op == "$gte":
+        return value >= expected
+    if op == "$lt":
+        return value < expected
+    if op == "$lte":
+        return value <= expected
+    raise ValueError(f"Unsupported where operator: {op}")
+
+
+_store = None
+
+
+def get_vector_store() -> VectorStore:
+    """Returns the process-wide backend selected by VECTOR_BACKEND."""
+    global _store
+    if _store is None:
+        if VECTOR_BACKEND == "local":
+            from services.local_index import open_partitioned_local_index
+            _store = open_partitioned_local_index()
+        elif VECTOR_BACKEND == "chroma":
+            from services.chroma_store import ChromaVectorStore, CHROMA_PARTITION_BY_SOURCE, open_partitioned_chroma_store
+            _store = open_partitioned_chroma_store() if CHROMA_PARTITION_BY_SOURCE else ChromaVectorStore()
+        else:
+            raise ValueError(f"Unknown VECTOR_BACKEND '{VECTOR_BACKEND}' (expected 'chroma' or 'local')")
+    return _store
+
+
+async def close_vector_store():
+    global _store
+    if _store is not None:
+        await _store.close()
+        _store = None
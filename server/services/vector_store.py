@@ -1,13 +1,16 @@
 import asyncio
 import logging
-import httpx
-import uuid
 import os
 import time
 import json
+from services.vector_backend import get_vector_store
+from services.lexical_index import get_lexical_index
+from services.retrieval_cache import get_retrieval_cache, invalidate_retrieval_cache, collection_version
+from services.single_flight import SingleFlight
+from services.metrics import span
+from services.embeddings import get_embeddings, get_query_embedding, EMBED_BATCH_SIZE
 
 # Setup Logging
-import os
 LOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server_error.log')
 logging.basicConfig(
     filename=LOG_FILE, 
@@ -15,247 +18,227 @@ logging.basicConfig(
     format='%(asctime)s %(levelname)s %(message)s'
 )
 
-CHROMA_HOST = os.getenv("CHROMA_HOST", "localhost")
-CHROMA_PORT = os.getenv("CHROMA_PORT", "8001")
-HOST_URL = f"http://{CHROMA_HOST}:{CHROMA_PORT}"
-# Standard V1 Root for ID-based ops
-API_V1_URL = f"{HOST_URL}/api/v1"
-API_V2_URL = f"{HOST_URL}/api/v2"
-# Tenant URL for Create/List
-TENANT = "default_tenant"
-DATABASE = "default_database"
-TENANT_API_URL = f"{API_V2_URL}/tenants/{TENANT}/databases/{DATABASE}"
-
-# Configure Gemini (REST)
-api_key = os.getenv("GEMINI_API_KEY")
-
-if not api_key:
-    print("WARNING: GEMINI_API_KEY not found. Embeddings will fail.")
-
-COLLECTION_NAME = "knowledge_base"
-_collection_id = None
-
-# Gemini text-embedding-004 is 768 dims
-EMBEDDING_MODEL = "models/text-embedding-004"
-EMBEDDING_DIM = 768 
-
-async def get_embeddings(texts):
-    """Generates embeddings using Gemini REST API (Batch)"""
-    if not api_key:
-        return None
-    try:
-        if isinstance(texts, str):
-            texts = [texts]
-        
-        # Batch Embed URL
-        url = f"https://generativelanguage.googleapis.com/v1beta/{EMBEDDING_MODEL}:batchEmbedContents?key={api_key}"
-        headers = {'Content-Type': 'application/json'}
-        
-        requests = [{"model": EMBEDDING_MODEL, "content": {"parts": [{"text": t}]}} for t in texts]
-        payload = {"requests": requests}
-
-
-        async with httpx.AsyncClient() as client:
-            for attempt in range(5):
-                try:
-                    resp = await client.post(url, json=payload, timeout=60.0)
-                    if resp.status_code == 200:
-                        result = resp.json()
-                        return [e['values'] for e in result.get('embeddings', [])]
-                    elif resp.status_code == 429:
-                        wait_time = min(60, 2 * (2 ** attempt)) # 2, 4, 8, 16, 32
-                        print(f"Embedding 429. Retrying in {wait_time}s...")
-                        await asyncio.sleep(wait_time)
-                        continue
-                    else:
-                        print(f"Embedding Batch Error {resp.status_code}: {resp.text}")
-                        logging.error(f"Embedding Batch API Error: {resp.text}")
-                        return None
-                except Exception as e:
-                     logging.error(f"Connection Error: {e}")
-                     if attempt == 4: raise e
-            return None
-
-    except Exception as e:
-        print(f"Error generating embeddings: {e}")
-        logging.error(f"Embedding Gen Error: {e}", exc_info=True)
-        return None
-
-async def get_query_embedding(text):
-    if not api_key:
-        return None
-    try:
-        # Single Embed URL
-        url = f"https://generativelanguage.googleapis.com/v1beta/{EMBEDDING_MODEL}:embedContent?key={api_key}"
-        headers = {'Content-Type': 'application/json'}
-        payload = {
-            "model": EMBEDDING_MODEL,
-            "content": {"parts": [{"text": text}]}
-        }
-
-
-        async with httpx.AsyncClient() as client:
-            for attempt in range(5):
-                try:
-                    resp = await client.post(url, json=payload, timeout=30.0)
-                    if resp.status_code == 200:
-                         result = resp.json()
-                         return result['embedding']['values']
-                    elif resp.status_code == 429:
-                        wait_time = min(60, 2 * (2 ** attempt))
-                        print(f"Query Embedding 429. Retrying in {wait_time}s...")
-                        await asyncio.sleep(wait_time)
-                        continue
-                    else:
-                        print(f"Query Embed Error {resp.status_code}: {resp.text}")
-                        logging.error(f"Query API Error: {resp.text}")
-                        return None
-                except Exception as e:
-                     logging.error(f"Connect Error: {e}")
-                     if attempt == 4: return None
-            return None
-
-    except Exception as e:
-        print(f"Error generating query embedding: {e}")
-        logging.error(f"Query Embedding Error: {e}", exc_info=True)
-        return None
-
-async def get_collection_id(client: httpx.AsyncClient):
-    global _collection_id
-    if _collection_id:
-        return _collection_id
-    
-    try:
-        # Create collection (Use Tenant logic)
-        payload = {"name": COLLECTION_NAME, "metadata": {"hnsw:space": "cosine"}}
-        
-        # Try Creating at Tenant Level
-        resp = await client.post(f"{TENANT_API_URL}/collections", json=payload)
-        
-        if resp.status_code == 200:
-            _collection_id = resp.json()["id"]
-            return _collection_id
-        
-        # If exists or fails, List it at Tenant Level
-        if resp.status_code != 200:
-             logs = await client.get(f"{TENANT_API_URL}/collections")
-             if logs.status_code == 200:
-                 cols = logs.json()
-                 for col in cols:
-                     if col["name"] == COLLECTION_NAME:
-                         _collection_id = col["id"]
-                         return _collection_id
-
-    except Exception as e:
-        print(f"Error getting collection: {e}")
-        return None
-    
-    return None
-
-async def add_documents(documents: list, metadatas: list, ids: list):
-    async with httpx.AsyncClient() as client:
-        col_id = await get_collection_id(client)
-        if not col_id:
-            print("Chroma Collection not found/created")
-            return
-        
-        # Generate Embeddings
-        # Gemini batch extraction
-        embeddings = []
+# Ingestion pipeline: chunks are embedded and upserted page by page.
+# The bounded queue lets embedding of page N+1 overlap the upsert of page N
+# without holding every vector of a large upload in memory.
+INGEST_PAGE_SIZE = int(os.getenv("INGEST_PAGE_SIZE", str(EMBED_BATCH_SIZE)))
+INGEST_QUEUE_DEPTH = int(os.getenv("INGEST_QUEUE_DEPTH", "2"))
+
+async def add_documents(documents: list, metadatas: list, ids: list, on_progress=None):
+    """Embeds and stores chunks page by page.
+
+    Returns {"chunks", "stored", "failed", "pages", "failed_pages",
+    "failed_ids"}; a failed page is reported in `failed_pages` (its chunk ids
+    in `failed_ids`) and does not roll back pages already stored. `on_progress(stored, failed, total)` is awaited after every page
+    with the running counts of stored and failed chunks.
+    """
+    store = get_vector_store()
+    pages = [
+        (start, min(start + INGEST_PAGE_SIZE, len(documents)))
+        for start in range(0, len(documents), INGEST_PAGE_SIZE)
+    ]
+    report = {"chunks": len(documents), "stored": 0, "failed": 0, "pages": len(pages), "failed_pages": [], "failed_ids": []}
+    queue = asyncio.Queue(maxsize=INGEST_QUEUE_DEPTH)
+    embedding_tasks = []
+
+    def fail(page_no, start, end, stage, error):
+        report["failed"] += end - start
+        report["failed_ids"].extend(ids[start:end])
+        print(f"Ingest page {page_no} failed during {stage}: {error}")
+        logging.error(f"Ingest Page Error (page {page_no}, {stage}): {error}")
+        report["failed_pages"].append({"page": page_no, "stage": stage, "error": str(error)})
+
+    async def produce():
+        # Embedding starts as soon as a page is queued; the queue depth bounds
+        # how many pages can be embedded ahead of the store.
+        for page_no, (start, end) in enumerate(pages):
+            task = asyncio.ensure_future(get_embeddings(documents[start:end]))
+            embedding_tasks.append(task)
+            await queue.put((page_no, start, end, task))
+        await queue.put(None)
+
+    async def store_page(page_no, start, end, task):
         try:
-             # OpenAI returns list of embeddings, we iterate
-             batch_embeddings = await get_embeddings(documents)
-             if batch_embeddings:
-                 embeddings = batch_embeddings
-             else:
-                 # Fallback empty (should not happen if error raised)
-                 embeddings = [[0.0]*EMBEDDING_DIM for _ in documents]
-
+            embeddings = await task
         except Exception as e:
-            print(f"Embedding failed: {e}")
-            logging.error(f"Embedding Batch Error: {e}", exc_info=True)
-            raise e
-
-        # Wait, if embeddings list len != ids len, Chroma will error.
-        if len(embeddings) != len(ids):
-            print("Mismatch in embedding count")
+            fail(page_no, start, end, "embed", e)
+            return
+        if not embeddings or len(embeddings) != end - start:
+            fail(page_no, start, end, "embed", "Embedding service returned no vectors")
             return
 
-        payload = {
-            "ids": ids,
-            "embeddings": embeddings,
-            "metadatas": metadatas,
-            "documents": documents 
-        }
-        
-        # Using Tenant-Scoped V2 URL for add/query as strictly required by this Chroma version
-        # Previously failed with V1 ID-based URLs
-        add_url = f"{TENANT_API_URL}/collections/{col_id}/add"
         try:
-            resp = await client.post(add_url, json=payload)
-            if resp.status_code != 200 and resp.status_code != 201:
-                print(f"Error adding docs ({resp.status_code}): {resp.text}")
-                logging.error(f"Chroma Add Error {resp.status_code}: {resp.text}")
-                raise Exception(f"Chroma add failed ({resp.status_code}): {resp.text}")
-        except Exception as cx:
-             logging.error(f"Chroma Connection Error: {cx}", exc_info=True)
-             raise cx
-
-async def query_documents(query_text: str, n_results: int = 3, where: dict = None):
-    async with httpx.AsyncClient() as client:
-        col_id = await get_collection_id(client)
-        if not col_id:
-            return []
+            await store.upsert(
+                ids=ids[start:end],
+                embeddings=embeddings,
+                documents=documents[start:end],
+                metadatas=metadatas[start:end],
+            )
+            report["stored"] += end - start
+            lexical = get_lexical_index()
+            if lexical is not None:
+                lexical.add(ids[start:end], documents[start:end], metadatas[start:end])
+            invalidate_retrieval_cache()
+        except Exception as e:
+            fail(page_no, start, end, "store", e)
+
+    async def consume():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            await store_page(*item)
+            if on_progress is not None:
+                await on_progress(report["stored"], report["failed"], len(documents))
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        await consume()
+    finally:
+        # On cancellation or error, stop pages that were queued (or embedding)
+        # but never stored, and wait for them so no request outlives the call
+        producer.cancel()
+        pending = [task for task in embedding_tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(producer, *pending, return_exceptions=True)
+    return report
+
+def source_filter(sources: list):
+    """Builds a where filter restricting retrieval to the given source documents."""
+    sources = [s for s in sources if s]
+    if not sources:
+        return None
+    if len(sources) == 1:
+        return {"source": sources[0]}
+    return {"source": {"$in": sources}}
+
+async def delete_documents(ids: list = None, where: dict = None):
+    """Deletes chunks from the vector store and every derived index."""
+    await get_vector_store().delete(ids=ids, where=where)
+    lexical = get_lexical_index()
+    if lexical is not None:
+        lexical.remove(ids=ids, where=where)
+    invalidate_retrieval_cache()
+
+async def update_metadata(ids: list, metadatas: list):
+    """Rewrites chunk metadata (e.g. page numbers of moved pages) without re-embedding."""
+    if not ids:
+        return
+    await get_vector_store().update_metadata(ids=ids, metadatas=metadatas)
+    lexical = get_lexical_index()
+    if lexical is not None:
+        lexical.update_metadata(ids, metadatas)
+    invalidate_retrieval_cache()
+
+async def rebuild_lexical_index():
+    """Loads every stored chunk into the in-memory BM25 index (called on startup)."""
+    lexical = get_lexical_index()
+    if lexical is None:
+        return 0
+    records = await get_vector_store().get()
+    lexical.clear()
+    lexical.add(records["ids"], [d or "" for d in records["documents"]], records["metadatas"])
+    invalidate_retrieval_cache()
+    return len(lexical)
+
+# Retrieval modes for knowledgeBase nodes
+VECTOR = "vector"
+LEXICAL = "lexical"
+HYBRID = "hybrid"
+RETRIEVAL_MODES = (VECTOR, LEXICAL, HYBRID)
+# Reciprocal-rank fusion constant; 60 is the value from the original RRF paper
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+async def _vector_search(query_text: str, n_results: int, where: dict) -> list:
+    # Embed Query
+    query_emb = await get_query_embedding(query_text)
+    if not query_emb:
+        return []
 
-        # Embed Query
-        query_emb = await get_query_embedding(query_text)
-        if not query_emb:
-            return []
+    store = get_vector_store()
+    result = await store.query(query_emb, n_results=n_results, where=where)
+    return [
+        {"id": id_, "document": doc, "metadata": meta, "score": 1.0 - dist}
+        for id_, doc, meta, dist in zip(result["ids"], result["documents"], result["metadatas"], result["distances"])
+    ]
 
-        payload = {
-            "query_embeddings": [query_emb],
-            "n_results": n_results,
-        }
-        
-        if where:
-             payload["where"] = where
-        
-        # Using Tenant-Scoped V2 URL
-        query_url = f"{TENANT_API_URL}/collections/{col_id}/query"
-        resp = await client.post(query_url, json=payload)
-        if resp.status_code == 200:
-            data = resp.json()
-            # If we need IDs to check existence, we should return the whole object or check how meaningful the return is
-            # For seeding check, getting any document is enough.
-            # But the original return was just documents list.
-            # To support "existence check" based on IDs (as per my proposed seed.py), I need to return more info or adapt seed.py
-            return data # Returning full response for flexibility
-            
-            # Note: Previously it returned data["documents"][0].
-            # This broke the signature expectation of other callers potentially.
-            # Let's check callers.
-            # workflow_engine.py calls it: docs = await query_documents(query)
-            # It expects a list of strings (documents).
-            
-            # I must preserve backward compatibility or update callers.
-            # workflow_engine expects: return data["documents"][0]
-            
-            # Let's keep it compatible but slightly hacked for seed check?
-            # Or better, just update callers?
-            # Creating a new function `check_existence` might be safer but `query_documents` is fine if I handle the return.
-            
-            # Re-evaluating:
-            # If I return `data` (dict), workflow_engine might break if it iterates it as a list.
-            
-            # Let's revert to returning documents list for now, but handle the seed check differently or just check if list is empty.
-            # If I filter by source and query "test", and get result, it exists.
-            
-            if "documents" in data and data["documents"]:
-                 # If including ids is needed, I can't just return documents[0]
-                 # But for now, let's just return documents[0] (which is a list of text).
-                 # Wait, if I want to check existence, checking if list is not empty is enough.
-                 return data["documents"][0]
-        else:
-            print(f"Query failed: {resp.text}")
-            
+def _lexical_search(query_text: str, n_results: int, where: dict) -> list:
+    lexical = get_lexical_index()
+    if lexical is None:
         return []
+    return [
+        {"id": id_, "document": doc, "metadata": meta, "score": score}
+        for id_, score, doc, meta in lexical.search(query_text, n_results=n_results, where=where)
+    ]
+
+def _fuse(result_lists: list, n_results: int) -> list:
+    """Reciprocal-rank fusion: score = sum(1 / (RRF_K + rank)) across result lists."""
+    fused = {}
+    for hits in result_lists:
+        for rank, hit in enumerate(hits, start=1):
+            entry = fused.setdefault(hit["id"], {**hit, "score": 0.0})
+            entry["score"] += 1.0 / (RRF_K + rank)
+    return sorted(fused.values(), key=lambda h: h["score"], reverse=True)[:n_results]
+
+# Identical retrievals running at the same time share one search
+retrieval_flight = SingleFlight()
+
+async def retrieve(query_text: str, n_results: int = 3, where: dict = None, mode: str = VECTOR) -> list:
+    """Returns [{"id", "document", "metadata", "score"}] best first, using the requested retrieval mode.
+
+    Results are served from the versioned retrieval cache when possible.
+    """
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode '{mode}' (expected one of {', '.join(RETRIEVAL_MODES)})")
+
+    with span("retrieve", {"n_results": n_results}, mode=mode) as trace_span:
+        hits = await _cached_retrieve(query_text, n_results, where, mode, trace_span)
+        trace_span.set(hits=len(hits))
+    return hits
+
+async def _cached_retrieve(query_text: str, n_results: int, where: dict, mode: str, trace_span) -> list:
+    cache = get_retrieval_cache()
+    if cache is None:
+        return await _shared_retrieve(query_text, n_results, where, mode)
+
+    key = cache.key(query_text, n_results, where, mode)
+    hits = cache.get(key)
+    trace_span.set(cache_hit=hits is not None)
+    if hits is not None:
+        return hits
+
+    started = time.perf_counter()
+    hits = await _shared_retrieve(query_text, n_results, where, mode)
+    # Empty results usually mean the embedding call failed; don't pin them
+    if hits:
+        cache.put(key, hits, time.perf_counter() - started)
+    return hits
+
+async def _shared_retrieve(query_text: str, n_results: int, where: dict, mode: str) -> list:
+    key = (collection_version(), mode, n_results, json.dumps(where, sort_keys=True) if where else "", query_text)
+    hits = await retrieval_flight.do(key, lambda: _retrieve(query_text, n_results, where, mode))
+    # Copies so concurrent callers can't mutate each other's hits
+    return [dict(hit) for hit in hits]
+
+async def _retrieve(query_text: str, n_results: int, where: dict, mode: str) -> list:
+    if mode == LEXICAL:
+        return _lexical_search(query_text, n_results, where)
+    if mode == VECTOR:
+        return await _vector_search(query_text, n_results, where)
+
+    # Hybrid: fuse a deeper candidate list from both retrievers.
+    # If the embedding call fails the lexical results still come through.
+    depth = max(n_results * 4, 20)
+    lexical_hits = _lexical_search(query_text, depth, where)
+    try:
+        vector_hits = await _vector_search(query_text, depth, where)
+    except Exception as e:
+        logging.error(f"Hybrid vector search failed, using lexical only: {e}", exc_info=True)
+        vector_hits = []
+    return _fuse([vector_hits, lexical_hits], n_results)
+
+async def query_documents(query_text: str, n_results: int = 3, where: dict = None, mode: str = VECTOR):
+    """Returns the text of the best matching chunks (best first)."""
+    hits = await retrieve(query_text, n_results=n_results, where=where, mode=mode)
+    return [hit["document"] for hit in hits]
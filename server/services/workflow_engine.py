@@ -1,226 +1,226 @@
-from typing import Dict, Any, List
-from models.workflow import WorkflowDefinition, Node, Edge, WorkflowResponse
-from services.vector_store import query_documents
-from services.vector_store import query_documents
+from typing import Dict, Any
+from models.workflow import WorkflowDefinition, WorkflowResponse
+from services.vector_store import retrieve, source_filter
+from services.context_assembler import assemble_context, describe_reduction, token_budget
+from services.embeddings import get_query_embedding
+from services.llm_cache import get_llm_cache, exact_key, sources_key
 # import google.generativeai as genai     # Deprecated/Broken for 1.5/2.0
 import asyncio
 import os
-import logging
-import httpx
-import json
-
-
-from services.vector_store import query_documents
-import asyncio
-import os
-import logging
-import httpx
-import json
-from openai import AsyncOpenAI
-from groq import AsyncGroq
-
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY")
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-
-aclient = AsyncOpenAI(api_key=OPENAI_API_KEY)
-pclient = AsyncOpenAI(api_key=PERPLEXITY_API_KEY, base_url="https://api.perplexity.ai")
-gclient = AsyncGroq(api_key=GROQ_API_KEY)
-
-async def generate_content_rest(prompt: str, model: str = "gemini-2.0-flash"):
-    if not GEMINI_API_KEY:
-        return "Error: No API Key configured."
-    
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={GEMINI_API_KEY}"
-    headers = {'Content-Type': 'application/json'}
-    data = {
-        "contents": [{
-            "parts": [{"text": prompt}]
-        }]
-    }
-    
-
-    async with httpx.AsyncClient() as client:
-        for attempt in range(5):
-            try:
-                resp = await client.post(url, json=data, timeout=30.0)
-                
-                if resp.status_code == 200:
-                    result = resp.json()
-                    try:
-                        text = result['candidates'][0]['content']['parts'][0]['text']
-                        return text
-                    except (KeyError, IndexError):
-                        logging.error(f"Unexpected Format: {result}")
-                        return "Error: Unexpected API response format."
-                elif resp.status_code == 429:
-                    wait_time = min(60, 2 * (2 ** attempt))
-                    print(f"Gemini Chat 429. Retrying in {wait_time}s...")
-                    await asyncio.sleep(wait_time)
-                    continue
-                else:
-                     return f"Error ({resp.status_code}): {resp.text}"
-            except Exception as e:
-                logging.error(f"REST Gen Error: {e}", exc_info=True)
-                if attempt == 4: return f"Error calling API after retries: {str(e)}"
-        return "Error: Max retries exceeded."
-
-
-
-
-async def execute_workflow(workflow: WorkflowDefinition, user_query: str) -> WorkflowResponse:
-    # 1. Build Adjacency List for Graph Traversal
-    adj_list = {node.id: [] for node in workflow.nodes}
-    node_map = {node.id: node for node in workflow.nodes}
-    in_degree = {node.id: 0 for node in workflow.nodes}
-    
-    for edge in workflow.edges:
-        if edge.source in adj_list and edge.target in in_degree:
-            adj_list[edge.source].append(edge.target)
-            in_degree[edge.target] += 1
-
-    # 2. Find Start Node (UserQuery)
-    start_nodes = [node for node in workflow.nodes if node.type == 'userQuery']
-    if not start_nodes:
-        return WorkflowResponse(answer="Error: No User Query node found.", logs=["Validation Failed"])
-    
-    # 3. Topological Search / Execution Queue
-    queue = [n.id for n in start_nodes]
-    execution_context: Dict[str, Any] = {"query": user_query, "history": []}
-    logs = []
-    final_output = ""
-
-    while queue:
-        current_id = queue.pop(0)
-        current_node = node_map[current_id]
-        logs.append(f"Executing Node: {current_node.data.label} ({current_node.type})")
-        
-        # PROCESS NODE
+import time
+from contextvars import ContextVar
+from services.llm_providers import complete
+from services.retrieval_cache import collection_version
+from services.single_flight import SingleFlight
+from services.metrics import span, collect_spans
+from services.workflow_plan import get_plan, node_handler, workflow_key, NodePlan, WorkflowPlan, WorkflowValidationError, NODE_HANDLERS
+
+# Max nodes of one workflow run executing at the same time
+WORKFLOW_MAX_CONCURRENCY = int(os.getenv("WORKFLOW_MAX_CONCURRENCY", "8"))
+
+# Set for streaming runs: async callback(event, data). Node tasks inherit it,
+# so handlers can report node progress and LLM tokens as they happen.
+_event_sink: ContextVar = ContextVar("workflow_event_sink", default=None)
+
+async def emit_event(event: str, **data):
+    sink = _event_sink.get()
+    if sink is not None:
+        await sink(event, data)
+
+def _token_callback(node):
+    """Returns an on_token callback streaming this node's tokens, or None for non-streaming runs."""
+    if _event_sink.get() is None:
+        return None
+    async def on_token(text: str):
+        await emit_event("token", node_id=node.id, text=text)
+    return on_token
+
+# Identical (workflow, query) runs in flight at the same time share one execution
+workflow_flight = SingleFlight()
+
+async def execute_workflow(workflow: WorkflowDefinition, user_query: str, on_event=None, include_spans: bool = False) -> WorkflowResponse:
+    """Runs a workflow. `on_event(event, data)` receives node_start/node_end/token events.
+
+    With `include_spans`, the response carries the run's timing spans.
+    """
+    try:
+        key = workflow_key(workflow)
+    except WorkflowValidationError as e:
+        return WorkflowResponse(answer=f"Error: {e}", logs=["Validation Failed"])
+    if on_event is None:
+        # Streaming runs need their own events, so only plain runs are shared.
+        # The collection version keeps runs started before an ingest from being
+        # handed to requests that arrive after it.
+        response = await workflow_flight.do(
+            (key, user_query, collection_version()),
+            lambda: _execute_workflow(workflow, user_query, key),
+        )
+        response = response.model_copy(deep=True)
+    else:
+        sink_token = _event_sink.set(on_event)
         try:
-            output = await process_node(current_node, execution_context, node_map)
-            execution_context[current_id] = output # Store output by node ID
-            if current_node.type == 'output':
-                final_output = str(output)
-        except Exception as e:
-            logs.append(f"Error in node {current_id}: {str(e)}")
-            return WorkflowResponse(answer="Error executing workflow.", logs=logs)
-
-        # Propagate to neighbors
-        for neighbor_id in adj_list[current_id]:
-            in_degree[neighbor_id] -= 1
-            if in_degree[neighbor_id] == 0:
-                queue.append(neighbor_id)
+            response = await _execute_workflow(workflow, user_query, key)
+        finally:
+            _event_sink.reset(sink_token)
+
+    if not include_spans:
+        response.spans = None
+    return response
+
+async def _execute_workflow(workflow: WorkflowDefinition, user_query: str, key: str = None) -> WorkflowResponse:
+    with collect_spans() as spans:
+        with span("workflow"):
+            response = await _run_workflow(workflow, user_query, key)
+    response.spans = spans
+    return response
+
+async def _run_workflow(workflow: WorkflowDefinition, user_query: str, key: str = None) -> WorkflowResponse:
+    # 1. Compile (or reuse) the execution plan: validated graph in topological levels
+    try:
+        plan = get_plan(workflow, key)
+    except WorkflowValidationError as e:
+        return WorkflowResponse(answer=f"Error: {e}", logs=["Validation Failed"])
+
+    # 2. Run every node as soon as all of its upstream nodes have finished.
+    # Independent branches run concurrently; a node only reads the outputs of
+    # its ancestors, which are complete before it starts, so results don't
+    # depend on scheduling order.
+    logs = [f"Skipping Node: {node} (not connected to a User Query node)" for node in plan.skipped]
+    execution_context: Dict[str, Any] = {"query": user_query, "history": [], "logs": logs}
+    semaphore = asyncio.Semaphore(WORKFLOW_MAX_CONCURRENCY)
+    waiting = {node_id: len(node.upstream) for node_id, node in plan.nodes.items()}
+    running = {}  # task -> node id
+
+    async def run_node(node):
+        async with semaphore:
+            logs.append(f"Executing Node: {node.label} ({node.type})")
+            await emit_event("node_start", node_id=node.id, type=node.type, label=node.label)
+            started = time.perf_counter()
+            # Node types come from the client; only the registered ones become metric labels
+            metric_type = node.type if node.type in NODE_HANDLERS else "other"
+            with span("node", {"node_id": node.id, "label": node.label, "node_type": node.type}, type=metric_type):
+                output = await node.handler(node, execution_context, plan)
+            await emit_event(
+                "node_end",
+                node_id=node.id,
+                type=node.type,
+                label=node.label,
+                duration_ms=round((time.perf_counter() - started) * 1000, 1),
+                output=output,
+            )
+            return output
+
+    def launch(node_id):
+        running[asyncio.ensure_future(run_node(plan.nodes[node_id]))] = node_id
+
+    for node_id in plan.levels[0]:
+        launch(node_id)
+
+    try:
+        while running:
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=lambda t: plan.rank[running[t]]):
+                current_id = running.pop(task)
+                try:
+                    execution_context[current_id] = task.result() # Store output by node ID
+                except Exception as e:
+                    logs.append(f"Error in node {current_id}: {str(e)}")
+                    return WorkflowResponse(answer="Error executing workflow.", logs=logs)
+
+                for target in plan.nodes[current_id].downstream:
+                    waiting[target] -= 1
+                    if waiting[target] == 0:
+                        launch(target)
+    finally:
+        for task in running:
+            task.cancel()
 
+    final_output = ""
+    output_ids = plan.node_ids_of_type('output')
+    if output_ids:
+        final_output = str(execution_context[output_ids[-1]])
     return WorkflowResponse(answer=final_output, logs=logs)
 
-async def process_node(node: Node, context: Dict[str, Any], node_map: Dict[str, Node]):
-    node_type = node.type
-    
-    if node_type == 'userQuery':
-        return context.get('query', '')
-    
-    elif node_type == 'knowledgeBase':
-        # Retrieve context from vector store based on query
-        # Assuming the input to this node is the query from a previous node
-        # For simplicity, we grab the global query or latest input
-        query = context.get('query', '')
-        docs = await query_documents(query)
-        context['kb_context'] = docs # Store for LLM (Global Context)
-        return docs
-    
-    elif node_type == 'llmEngine':
-        query = context.get('query', '')
-        kb_context = context.get('kb_context', [])
-
-        # Real LLM Call (REST)
-        prompt = f"System: {node.data.config.get('system_prompt', 'You are a helpful assistant.')}\n"
-        if kb_context:
-            prompt += f"Context: {kb_context}\n"
-        prompt += f"User: {query}"
-        
-
-        # Determine Model Provider based on config
-        model_name = node.data.config.get('model', 'gemini-2.0-flash')
-        
-        if model_name.startswith("gpt"):
-             # OpenAI Path
-             if not OPENAI_API_KEY:
-                 return "Error: OpenAI API Key missing."
-             try:
-                response = await aclient.chat.completions.create(
-                    model=model_name,
-                    messages=[
-                        {"role": "system", "content": node.data.config.get('system_prompt', 'You are a helpful assistant.')},
-                        {"role": "user", "content": f"Context: {kb_context}\n\nQuestion: {query}"}
-                    ]
-                )
-                return response.choices[0].message.content
-             except Exception as e:
-                 logging.error(f"OpenAI Error: {e}", exc_info=True)
-                 return f"Error (OpenAI): {str(e)}"
-        
-        elif model_name.startswith("perplexity"):
-             # Perplexity Path
-             if not PERPLEXITY_API_KEY:
-                 return "Error: Perplexity API Key missing."
-             try:
-                response = await pclient.chat.completions.create(
-                    model=model_name,
-                    messages=[
-                        {"role": "system", "content": node.data.config.get('system_prompt', 'You are a helpful assistant.')},
-                        {"role": "user", "content": f"Context: {kb_context}\n\nQuestion: {query}"}
-                    ]
-                )
-                return response.choices[0].message.content
-             except Exception as e:
-                 logging.error(f"Perplexity Error: {e}", exc_info=True)
-                 return f"Error (Perplexity): {str(e)}"
-
-             except Exception as e:
-                 logging.error(f"Perplexity Error: {e}", exc_info=True)
-                 return f"Error (Perplexity): {str(e)}"
-        
-        elif model_name.startswith("llama") or model_name.startswith("mixtral"):
-             # Groq Path
-             if not GROQ_API_KEY:
-                 return "Error: Groq API Key missing."
-             try:
-                response = await gclient.chat.completions.create(
-                    model=model_name,
-                    messages=[
-                        {"role": "system", "content": node.data.config.get('system_prompt', 'You are a helpful assistant.')},
-                        {"role": "user", "content": f"Context: {kb_context}\n\nQuestion: {query}"}
-                    ]
-                )
-                return response.choices[0].message.content
-             except Exception as e:
-                 logging.error(f"Groq Error: {e}", exc_info=True)
-                 return f"Error (Groq): {str(e)}"
-
-        else:
-             # Default / Gemini Path
-             response_text = await generate_content_rest(prompt, model_name)
-             return response_text
-
-    elif node_type == 'output':
-        # Retrieve the result from the LLM engine or the last significant operation
-        # In this linear flow: Query -> (KB) -> LLM -> Output
-        # We check execution_context for 'llmEngine' output first, then 'knowledgeBase', then 'query'
-        
-        # Helper to find upstream data
-        # In a real graph, we traverse edges backwards.
-        # For this prototype, we iterate context values.
-        
-        # Check if any LLM node has run
-        for nid, val in context.items():
-            if nid in node_map and node_map[nid].type == 'llmEngine':
-                 return val
-        
-        # Fallback to KB
-        if 'kb_context' in context and context['kb_context']:
-            return f"Retrieved Context: {context['kb_context']}"
-
-        return "Output Node Reached (No Upstream Data)"
-
-    return None
+def _kb_hits(node: NodePlan, context: Dict[str, Any], plan: WorkflowPlan) -> list:
+    """One best-first hit list per knowledgeBase node this node depends on, in plan order."""
+    return [context.get(kb_id) or [] for kb_id in plan.ancestors_of_type(node.id, 'knowledgeBase')]
+
+def _kb_context(node: NodePlan, context: Dict[str, Any], plan: WorkflowPlan) -> list:
+    """Documents retrieved by the knowledgeBase nodes this node depends on, in plan order."""
+    return [hit["document"] for hits in _kb_hits(node, context, plan) for hit in hits]
+
+@node_handler('userQuery')
+async def run_user_query(node: NodePlan, context: Dict[str, Any], plan: WorkflowPlan):
+    return context.get('query', '')
+
+@node_handler('knowledgeBase')
+async def run_knowledge_base(node: NodePlan, context: Dict[str, Any], plan: WorkflowPlan):
+    # Retrieve context from vector store based on query
+    # Assuming the input to this node is the query from a previous node
+    # For simplicity, we grab the global query or latest input
+    query = context.get('query', '')
+
+    # Scope retrieval to the files configured on the node (whole collection if none)
+    config = node.config
+    sources = config.get('fileNames') or ([config['fileName']] if config.get('fileName') else [])
+    top_k = int(config.get('topK', 3))
+    # 'vector' (default), 'lexical' (BM25 over stored chunks, no embedding call at query time) or 'hybrid' (rank fusion of both)
+    mode = config.get('retrievalMode', 'vector')
+    # Full hits (not just text): source and chunk metadata let the LLM node merge adjacent chunks
+    return await retrieve(query, n_results=top_k, where=source_filter(list(sources)), mode=mode)
+
+@node_handler('llmEngine')
+async def run_llm_engine(node: NodePlan, context: Dict[str, Any], plan: WorkflowPlan):
+    query = context.get('query', '')
+    system_prompt = node.config.get('system_prompt', 'You are a helpful assistant.')
+    model_name = node.config.get('model', 'gemini-2.0-flash')
+    on_token = _token_callback(node)
+
+    # Deduplicated, merged and budgeted context instead of the raw list of chunks
+    kb_hits = _kb_hits(node, context, plan)
+    kb_context, report = assemble_context(kb_hits, token_budget(model_name, node.config.get('contextTokenBudget')))
+    if report["chunks"]:
+        context['logs'].append(describe_reduction(node.label, report))
+
+    # Nodes can opt out of the response cache with config {"cache": false}
+    cache = get_llm_cache() if node.config.get('cache', True) is not False else None
+    if cache is None:
+        return await complete(model_name, system_prompt, kb_context, query, on_token)
+
+    key = exact_key(model_name, system_prompt, kb_context, query)
+    answer = cache.get(key)
+    group = embedding = None
+    if answer is None and cache.semantic:
+        group = sources_key(model_name, system_prompt, report["chunk_ids"])
+        # Usually served from the embedding cache: the knowledgeBase node embedded the same query
+        embedding = await get_query_embedding(query)
+        answer = cache.get_similar(group, embedding)
+    if answer is not None:
+        if on_token:
+            await on_token(answer)
+        return answer
+
+    cache.record_miss()
+    started = time.perf_counter()
+    answer = await complete(model_name, system_prompt, kb_context, query, on_token)
+    # Provider failures are reported as "Error..." answers; never cache those
+    if isinstance(answer, str) and answer and not answer.startswith("Error"):
+        cache.put(key, answer, time.perf_counter() - started, group=group, query=query, embedding=embedding)
+    return answer
+
+@node_handler('output')
+async def run_output(node: NodePlan, context: Dict[str, Any], plan: WorkflowPlan):
+    # Show the answer of the LLM engines feeding this node; fall back to the
+    # retrieved context when there are none (Query -> KB -> Output)
+    llm_ids = [n for n in node.upstream if plan.nodes[n].type == 'llmEngine'] or plan.ancestors_of_type(node.id, 'llmEngine')[-1:]
+    if len(llm_ids) == 1:
+        return context[llm_ids[0]]
+    if llm_ids:
+        # Fan-in from several engines (e.g. comparing models): one section each
+        return "\n\n".join(f"**{plan.nodes[n].label}**\n{context[n]}" for n in llm_ids)
+
+    kb_context = _kb_context(node, context, plan)
+    if kb_context:
+        return f"Retrieved Context: {kb_context}"
+
+    return "Output Node Reached (No Upstream Data)"
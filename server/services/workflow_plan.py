@@ -0,0 +1,233 @@
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Callable, Mapping, Tuple
+
+from models.workflow import WorkflowDefinition
+
+# Workflows are compiled once into an immutable plan: validated graph,
+# topological levels, resolved node handlers and per-node upstream
+# dependencies. Plans are cached by a canonical hash of the graph (node
+# positions and edge ids don't affect it), so repeated runs of the same stack
+# skip all graph work.
+
+WORKFLOW_PLAN_CACHE_SIZE = int(os.getenv("WORKFLOW_PLAN_CACHE_SIZE", "256"))
+
+START_NODE_TYPE = "userQuery"
+
+# node type -> async handler(node: NodePlan, context: dict, plan: WorkflowPlan)
+NODE_HANDLERS = {}
+
+
+def node_handler(node_type: str):
+    """Registers the handler that executes nodes of `node_type`."""
+    def register(fn):
+        NODE_HANDLERS[node_type] = fn
+        return fn
+    return register
+
+
+async def _noop_handler(node, context, plan):
+    # Node types the engine doesn't implement (yet) pass nothing downstream
+    return None
+
+
+class WorkflowValidationError(Exception):
+    """The workflow graph can't be executed (no start node, duplicate node ids, cycle...)."""
+
+
+@dataclass(frozen=True)
+class NodePlan:
+    id: str
+    type: str
+    label: str
+    config: Mapping[str, Any]
+    upstream: Tuple[str, ...]      # ids of nodes feeding this one, in edge order
+    downstream: Tuple[str, ...]
+    ancestors: Tuple[str, ...]     # every node this one transitively depends on, in plan order
+    handler: Callable
+
+
+@dataclass(frozen=True)
+class WorkflowPlan:
+    key: str
+    nodes: Mapping[str, NodePlan]
+    levels: Tuple[Tuple[str, ...], ...]   # nodes in a level only depend on earlier levels
+    order: Tuple[str, ...]                # levels flattened
+    rank: Mapping[str, int]               # node id -> position in `order`
+    skipped: Tuple[str, ...] = ()         # "label (id)" of nodes not connected to a User Query node
+
+    def node_ids_of_type(self, node_type: str) -> Tuple[str, ...]:
+        return tuple(node_id for node_id in self.order if self.nodes[node_id].type == node_type)
+
+    def ancestors_of_type(self, node_id: str, node_type: str) -> Tuple[str, ...]:
+        return tuple(a for a in self.nodes[node_id].ancestors if self.nodes[a].type == node_type)
+
+
+def _check_node_ids(workflow: WorkflowDefinition):
+    seen = set()
+    for node in workflow.nodes:
+        if node.id in seen:
+            raise WorkflowValidationError(f"Duplicate node id: {node.id}")
+        seen.add(node.id)
+
+
+def workflow_key(workflow: WorkflowDefinition) -> str:
+    """Canonical hash of the parts of a graph that affect execution. Raises WorkflowValidationError on duplicate node ids."""
+    _check_node_ids(workflow)
+    canonical = {
+        "nodes": sorted(
+            ([node.id, node.type, node.data.label, node.data.config] for node in workflow.nodes),
+            key=lambda item: item[0],
+        ),
+        "edges": [[edge.source, edge.target] for edge in workflow.edges],
+    }
+    payload = json.dumps(canonical, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _describe(node_ids, nodes: dict) -> str:
+    return ", ".join(f"{nodes[n].data.label} ({n})" for n in sorted(node_ids))
+
+
+def compile_workflow(workflow: WorkflowDefinition, key: str = None) -> WorkflowPlan:
+    """Validates a workflow and builds its execution plan. Raises WorkflowValidationError."""
+    _check_node_ids(workflow)
+    nodes = {node.id: node for node in workflow.nodes}
+
+    start_ids = [node.id for node in workflow.nodes if node.type == START_NODE_TYPE]
+    if not start_ids:
+        raise WorkflowValidationError("No User Query node found.")
+
+    # Only nodes reachable from a User Query node run; the rest are skipped, as before
+    links = {node_id: [] for node_id in nodes}
+    for edge in workflow.edges:
+        # Edges left dangling by the editor are ignored, as before
+        if edge.source in nodes and edge.target in nodes:
+            links[edge.source].append(edge.target)
+    reachable = set(start_ids)
+    stack = list(start_ids)
+    while stack:
+        for target in links[stack.pop()]:
+            if target not in reachable:
+                reachable.add(target)
+                stack.append(target)
+    unreachable = set(nodes) - reachable
+    if unreachable:
+        logging.warning(f"Skipping nodes not connected to a User Query node: {_describe(unreachable, nodes)}")
+    skipped = tuple(f"{nodes[n].data.label} ({n})" for n in sorted(unreachable))
+    nodes = {node_id: node for node_id, node in nodes.items() if node_id in reachable}
+
+    upstream = {node_id: [] for node_id in nodes}
+    downstream = {node_id: [] for node_id in nodes}
+    for edge in workflow.edges:
+        if edge.source in nodes and edge.target in nodes and edge.source not in upstream[edge.target]:
+            upstream[edge.target].append(edge.source)
+            downstream[edge.source].append(edge.target)
+
+    # Kahn's algorithm, one level at a time
+    in_degree = {node_id: len(upstream[node_id]) for node_id in nodes}
+    # Preserve the order nodes were defined in within each level
+    position = {node_id: i for i, node_id in enumerate(nodes)}
+    level = sorted((n for n, d in in_degree.items() if d == 0), key=position.get)
+    levels = []
+    while level:
+        levels.append(tuple(level))
+        next_level = []
+        for node_id in level:
+            for target in downstream[node_id]:
+                in_degree[target] -= 1
+                if in_degree[target] == 0:
+                    next_level.append(target)
+        level = sorted(next_level, key=position.get)
+
+    order = tuple(node_id for lvl in levels for node_id in lvl)
+    if len(order) != len(nodes):
+        raise WorkflowValidationError(f"Workflow contains a cycle through: {_describe(set(nodes) - set(order), nodes)}")
+
+    rank = {node_id: i for i, node_id in enumerate(order)}
+    ancestors = {}
+    for node_id in order:
+        found = set(upstream[node_id])
+        for parent in upstream[node_id]:
+            found.update(ancestors[parent])
+        ancestors[node_id] = found
+
+    plans = {
+        node_id: NodePlan(
+            id=node_id,
+            type=node.type,
+            label=node.data.label,
+            config=_freeze(dict(node.data.config)),
+            upstream=tuple(upstream[node_id]),
+            downstream=tuple(downstream[node_id]),
+            ancestors=tuple(sorted(ancestors[node_id], key=rank.get)),
+            handler=NODE_HANDLERS.get(node.type, _noop_handler),
+        )
+        for node_id, node in nodes.items()
+    }
+    return WorkflowPlan(
+        key=key or workflow_key(workflow),
+        nodes=MappingProxyType(plans),
+        levels=tuple(levels),
+        order=order,
+        rank=MappingProxyType(rank),
+        skipped=skipped,
+    )
+
+
+class PlanCache:
+    """LRU of compiled plans keyed by workflow_key."""
+
+    def __init__(self, max_items: int = WORKFLOW_PLAN_CACHE_SIZE):
+        self.max_items = max_items
+        self._plans = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_plan(self, workflow: WorkflowDefinition, key: str = None) -> WorkflowPlan:
+        key = key or workflow_key(workflow)
+        plan = self._plans.get(key)
+        if plan is not None:
+            self._plans.move_to_end(key)
+            self.hits += 1
+            return plan
+
+        self.misses += 1
+        plan = compile_workflow(workflow, key)
+        self._plans[key] = plan
+        while len(self._plans) > self.max_items:
+            self._plans.popitem(last=False)
+        return plan
+
+    def clear(self):
+        self._plans.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "items": len(self._plans),
+        }
+
+
+plan_cache = PlanCache()
+
+
+def get_plan(workflow: WorkflowDefinition, key: str = None) -> WorkflowPlan:
+    """Returns the cached plan for a workflow, compiling it on first use. `key` skips re-hashing."""
+    return plan_cache.get_plan(workflow, key)
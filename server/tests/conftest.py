@@ -0,0 +1,9 @@
+import logging
+import os
+import sys
+
+# Tests import the server modules the way main.py does (`services.…`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Configure logging before the services do, so test runs don't write to services/server_error.log
+logging.basicConfig(handlers=[logging.NullHandler()], level=logging.ERROR)
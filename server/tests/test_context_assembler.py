@@ -0,0 +1,38 @@
+from services.context_assembler import assemble_context, overlap_length
+from services.rate_limiter import estimate_tokens
+
+
+def _hit(id_, text, chunk, **meta):
+    return {"id": id_, "document": text, "metadata": {"source": "doc.pdf", "chunk": chunk, **meta}}
+
+
+def test_periodic_text_merges_only_the_chunk_overlap():
+    text = "the same line repeated. " * 100  # period of 24 characters
+    first, second = text[:1000], text[900:1900]
+
+    assert overlap_length(first, second, max_overlap=100) == 100
+
+    context, report = assemble_context([[_hit("a", first, 0, chunk_overlap=100), _hit("b", second, 1, chunk_overlap=100)]], 10000)
+    body = context.split("\n", 1)[1]
+    assert report["passages"] == 1
+    assert body == text[:1900].strip()
+
+
+def test_overlap_defaults_to_configured_chunk_overlap():
+    text = "abcdefg" * 300
+    first, second = text[:1000], text[900:1900]
+    # No chunk_overlap metadata: capped at CHUNK_OVERLAP (100 by default)
+    context, _ = assemble_context([[_hit("a", first, 0), _hit("b", second, 1)]], 10000)
+    assert context.split("\n", 1)[1] == text[:1900]
+
+
+def test_no_overlap_below_minimum_match():
+    assert overlap_length("x" * 500 + "tail", "tail and more text that follows", max_overlap=100) == 0
+
+
+def test_context_stays_within_budget_including_headers():
+    hits = [_hit(str(i), f"chunk {i} " + "word " * 60, i * 2, page_start=i + 1, page_end=i + 1) for i in range(10)]
+    for budget in (20, 50, 125, 300):
+        context, report = assemble_context([hits], budget)
+        assert estimate_tokens(context) <= budget
+        assert report["tokens_after"] <= budget
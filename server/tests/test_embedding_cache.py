@@ -0,0 +1,32 @@
+import asyncio
+import threading
+
+from services.embedding_cache import EmbeddingCache
+
+
+def test_disk_tier_runs_off_the_event_loop(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite3")
+    threads = []
+
+    async def scenario():
+        loop_thread = threading.get_ident()
+        writer = EmbeddingCache(max_items=10, db_path=path)
+        await writer.put_many("m", ["a", "b"], [[1.0, 2.0], [3.0, 4.0]])
+        await writer.close()
+
+        reader = EmbeddingCache(max_items=10, db_path=path)
+        load = reader._load_from_disk
+
+        def tracked_load(keys):
+            threads.append(threading.get_ident())
+            return load(keys)
+
+        reader._load_from_disk = tracked_load
+        vectors = await reader.get_many("m", ["a", "b", "c"])
+        await reader.close()
+        return loop_thread, vectors, reader.stats()
+
+    loop_thread, vectors, stats = asyncio.run(scenario())
+    assert vectors == [[1.0, 2.0], [3.0, 4.0], None]
+    assert stats["disk_hits"] == 2 and stats["misses"] == 1
+    assert threads and loop_thread not in threads
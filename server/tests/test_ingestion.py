@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+import services.ingestion as ingestion
+import services.vector_store as vector_store
+from services.local_index import LocalVectorIndex
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    index = LocalVectorIndex(path=str(tmp_path / "index"), dim=4)
+    monkeypatch.setattr(ingestion, "get_vector_store", lambda: index)
+    monkeypatch.setattr(vector_store, "get_vector_store", lambda: index)
+    monkeypatch.setattr(vector_store, "get_lexical_index", lambda: None)
+    return index
+
+
+def _embedder(state):
+    async def get_embeddings(texts):
+        if state["fail"]:
+            return None
+        return [[1.0, float(len(text)), 0.0, 1.0] for text in texts]
+    return get_embeddings
+
+
+async def _ingest(pages):
+    plan = await ingestion.plan_text("doc.pdf", pages, chunk_size=300, overlap=30)
+    stored = await ingestion.store_plan(plan)
+    return await ingestion.finish_source(plan, stored["stored"], stored["failed_pages"], stored["failed_ids"])
+
+
+def test_failed_reingest_keeps_old_chunks_of_changed_page(store, monkeypatch):
+    state = {"fail": False}
+    monkeypatch.setattr(vector_store, "get_embeddings", _embedder(state))
+    pages = [(i + 1, f"Page {i} " + f"lorem ipsum dolor sit amet {i} " * 20) for i in range(4)]
+
+    async def scenario():
+        first = await _ingest(pages)
+        before = await store.get(where={"source": "doc.pdf"})
+
+        state["fail"] = True
+        pages[1] = (2, "CHANGED " + pages[1][1])
+        second = await _ingest(pages)
+        after = await store.get(where={"source": "doc.pdf"})
+        return first, before, second, after
+
+    first, before, second, after = asyncio.run(scenario())
+
+    assert first["stored"] == len(before["ids"])
+    assert second["new"] > 0 and second["stored"] == 0
+    assert second["removed"] == 0
+    assert second["kept_stale"] > 0
+    # Page 2 still has exactly its old chunks
+    assert sorted(after["ids"]) == sorted(before["ids"])
+    assert {meta["page_start"] for meta in after["metadatas"]} == {1, 2, 3, 4}
+
+
+def test_successful_reingest_replaces_changed_page(store, monkeypatch):
+    monkeypatch.setattr(vector_store, "get_embeddings", _embedder({"fail": False}))
+    pages = [(i + 1, f"Page {i} " + f"lorem ipsum dolor sit amet {i} " * 20) for i in range(4)]
+
+    async def scenario():
+        await _ingest(pages)
+        old_page_two = await store.get(where={"page_start": 2})
+        pages[1] = (2, "CHANGED " + pages[1][1])
+        report = await _ingest(pages)
+        return report, old_page_two, await store.get(where={"page_start": 2})
+
+    report, old_page_two, page_two = asyncio.run(scenario())
+
+    assert report["removed"] == len(old_page_two["ids"]) and report["kept_stale"] == 0
+    assert not set(old_page_two["ids"]) & set(page_two["ids"])
+    assert page_two["documents"][0].startswith("CHANGED")
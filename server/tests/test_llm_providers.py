@@ -0,0 +1,46 @@
+import asyncio
+
+from services.llm_providers import LLMProvider, _hedged_call
+
+
+def _provider(name, started, cancelled, delay):
+    async def call(model, *args):
+        started.append(name)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(name)
+            raise
+        return f"{name} answer"
+    return LLMProvider(name, name, "key", (name,), call, max_concurrency=2, timeout=5)
+
+
+def test_cancelling_a_hedged_call_cancels_the_upstream_calls():
+    started, cancelled = [], []
+    primary = _provider("slow", started, cancelled, 10)
+    hedge = _provider("hedge", started, cancelled, 10)
+
+    async def scenario(cancel_after):
+        started.clear()
+        cancelled.clear()
+        task = asyncio.ensure_future(_hedged_call(primary, "slow-1", (hedge, "hedge-1"), 0.05, ("system", "", "q", None), set()))
+        await asyncio.sleep(cancel_after)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0.01)
+        # Checked before asyncio.run cancels whatever is left
+        return list(started), sorted(cancelled)
+
+    # Cancelled while waiting for the primary, before the hedge starts
+    assert asyncio.run(scenario(0.01)) == (["slow"], ["slow"])
+    # Cancelled while both race
+    assert asyncio.run(scenario(0.1)) == (["slow", "hedge"], ["hedge", "slow"])
+
+
+def test_hedge_wins_when_primary_is_slow():
+    started, cancelled = [], []
+    primary = _provider("slow", started, cancelled, 10)
+    hedge = _provider("fast", started, cancelled, 0)
+    answer = asyncio.run(_hedged_call(primary, "slow-1", (hedge, "fast-1"), 0.01, ("system", "", "q", None), set()))
+    assert answer == "fast answer"
+    assert primary.hedge_wins == 1 and cancelled == ["slow"]
@@ -0,0 +1,28 @@
+import asyncio
+
+import services.local_index as local_index
+from services.local_index import LocalVectorIndex
+
+
+def test_concurrent_writes_that_grow_the_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(local_index, "INITIAL_CAPACITY", 2)
+    path = str(tmp_path / "index")
+    index = LocalVectorIndex(path=path, dim=4)
+
+    async def add(batch: int):
+        ids = [f"{batch}-{i}" for i in range(3)]
+        await index.add(ids, [[1.0, batch, i, 1.0] for i in range(3)], ids, [{"batch": batch}] * 3)
+
+    async def scenario():
+        # Each batch outgrows the matrix while earlier batches are still being persisted
+        await asyncio.gather(*(add(batch) for batch in range(40)))
+        await index.close()
+
+    asyncio.run(scenario())
+
+    reopened = LocalVectorIndex(path=path, dim=4)
+    stored = asyncio.run(reopened.get())
+    assert sorted(stored["ids"]) == sorted(f"{b}-{i}" for b in range(40) for i in range(3))
+    hit = asyncio.run(reopened.query([1.0, 7.0, 2.0, 1.0], n_results=1))
+    assert hit["ids"] == ["7-2"]
+    asyncio.run(reopened.close())
@@ -0,0 +1,19 @@
+import asyncio
+
+import services.metrics as metrics
+from services.workflow_engine import execute_workflow
+from test_workflow_plan import _workflow
+
+
+def test_unknown_node_types_share_one_metric_label():
+    workflow = _workflow(
+        [("q", "userQuery"), ("x", "client-made-type-123"), ("out", "output")],
+        [("q", "x"), ("x", "out")],
+    )
+    response = asyncio.run(execute_workflow(workflow, "hello", include_spans=True))
+
+    node_labels = {dict(labels).get("type") for (name, labels) in metrics._histograms if dict(labels).get("span") == "node"}
+    assert "client-made-type-123" not in node_labels
+    assert {"userQuery", "output", "other"} <= node_labels
+    # The raw type stays visible in the run's trace
+    assert any(s.get("node_type") == "client-made-type-123" for s in response.spans)
@@ -0,0 +1,30 @@
+import pytest
+
+from models.workflow import WorkflowDefinition
+from services.workflow_plan import WorkflowValidationError, compile_workflow, workflow_key
+
+
+def _workflow(nodes, edges):
+    return WorkflowDefinition(
+        nodes=[{"id": id_, "type": type_, "position": {"x": 0, "y": 0}, "data": {"label": type_, "config": {"k": id_}}} for id_, type_ in nodes],
+        edges=[{"id": f"e{i}", "source": source, "target": target} for i, (source, target) in enumerate(edges)],
+    )
+
+
+def test_duplicate_node_ids_are_a_validation_error():
+    workflow = _workflow([("q", "userQuery"), ("a", "llmEngine"), ("a", "llmEngine")], [("q", "a")])
+    with pytest.raises(WorkflowValidationError, match="Duplicate node id: a"):
+        workflow_key(workflow)
+    with pytest.raises(WorkflowValidationError, match="Duplicate node id: a"):
+        compile_workflow(workflow)
+
+
+def test_unreachable_nodes_are_skipped():
+    workflow = _workflow(
+        [("q", "userQuery"), ("llm", "llmEngine"), ("out", "output"), ("loose", "knowledgeBase"), ("x", "llmEngine")],
+        [("q", "llm"), ("llm", "out"), ("loose", "x"), ("x", "loose"), ("loose", "llm")],
+    )
+    plan = compile_workflow(workflow)
+    assert plan.order == ("q", "llm", "out")
+    assert plan.nodes["llm"].upstream == ("q",)
+    assert plan.skipped == ("knowledgeBase (loose)", "llmEngine (x)")